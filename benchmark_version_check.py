@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+
+"""Tool to benchmark check_3rdparty_latest_versions.py offline against recorded pages"""
+
+import argparse
+import gzip
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, urlsplit
+from urllib.request import build_opener, HTTPCookieProcessor, Request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+VERSION_CHECK = os.path.join(SCRIPT_DIR, "check_3rdparty_latest_versions.py")
+DEFAULT_DATA_DIR = os.path.join(SCRIPT_DIR, "benchmark_data")
+
+# Parse times below this many seconds are too small to compare reliably
+PARSE_TIME_FLOOR = 0.005
+# Modules only some modes need, which a single-tool check mustn't import
+LAZY_MODULES = ["bs4", "concurrent.futures", "http.server", "multiprocessing",
+    "statistics"]
+
+
+def page_file(host, path):
+    """File name a page is recorded under, inside the directory of its host"""
+    return os.path.join(host, quote(path, safe="") or "%2F")
+
+
+def recorded_urls():
+    """Every URL the version check reads, with the headers it sends"""
+    output = subprocess.run([sys.executable, VERSION_CHECK, "--list-urls"],
+        check=True, stdout=subprocess.PIPE)
+    return json.loads(output.stdout.decode("utf-8"))
+
+
+def record(pages_dir):
+    """
+    Download every page the version check reads into pages_dir, with a
+    manifest mapping host and path to the file and its content type
+    """
+    opener = build_opener(HTTPCookieProcessor())
+    manifest = {}
+    for url, headers in sorted(recorded_urls().items()):
+        split_url = urlsplit(url)
+        path = split_url.path + (f"?{split_url.query}" if split_url.query else "")
+        file_name = page_file(split_url.hostname, path)
+        try:
+            with opener.open(Request(url, headers=headers)) as response:
+                body = response.read()
+                content_type = response.headers.get("Content-Type", "text/html")
+        except OSError as error:
+            print(f"{url} could not be recorded: {error}")
+            continue
+        os.makedirs(os.path.join(pages_dir, split_url.hostname), exist_ok=True)
+        with open(os.path.join(pages_dir, file_name), "wb") as page:
+            page.write(body)
+        manifest[f"{split_url.hostname}{path}"] = {
+            "file": file_name,
+            "content_type": content_type,
+        }
+        print(f"Recorded {url} ({len(body)} bytes)")
+
+    with open(os.path.join(pages_dir, "manifest.json"), "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+
+
+class ReplayServer(ThreadingHTTPServer):
+    """
+    Serve recorded pages at /<host>/<path>, shaping each host's traffic
+
+    network maps host names (or "default") to a latency in seconds before the
+    response, a handshake in seconds added to the first request on each
+    connection, a bandwidth in bytes per second, and a failure_rate with the
+    failure_status to answer with, or "drop" to close the connection. Like
+    most real hosts, pages are compressed when the client accepts it, with
+    brotli if it's installed here and gzip otherwise.
+    """
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, pages_dir, network, seed):
+        super().__init__(("127.0.0.1", 0), ReplayHandler)
+        self.pages_dir = pages_dir
+        self.network = network
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+        # Compressed bodies by (file, coding), made on first request
+        self.encoded = {}
+        self.encoded_lock = threading.Lock()
+        with open(os.path.join(pages_dir, "manifest.json"), "r", encoding="utf-8") as manifest:
+            self.manifest = json.load(manifest)
+
+    @property
+    def url(self):
+        """Base URL to pass to the version check as --replay-url"""
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def shaping(self, host):
+        """Network settings for host, falling back to the defaults"""
+        settings = {"latency": 0.0, "handshake": 0.0, "bandwidth": None, "failure_rate": 0.0,
+            "failure_status": 503}
+        settings.update(self.network.get("default", {}))
+        settings.update(self.network.get("hosts", {}).get(host, {}))
+        return settings
+
+    def handle_error(self, request, client_address):
+        # A client hanging up on a kept-alive connection is nothing to report
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def encode(self, file_name, body, accept_encoding):
+        """The body to send for accept_encoding, and its Content-Encoding or None"""
+        accepted = {coding.split(";")[0].strip() for coding in accept_encoding.split(",")}
+        if brotli and "br" in accepted:
+            coding, compress = "br", brotli.compress
+        elif "gzip" in accepted:
+            coding, compress = "gzip", gzip.compress
+        else:
+            return body, None
+        with self.encoded_lock:
+            if (file_name, coding) not in self.encoded:
+                self.encoded[file_name, coding] = compress(body)
+            return self.encoded[file_name, coding], coding
+
+    def should_fail(self, rate):
+        """Draw whether to inject a failure, from the seeded generator"""
+        with self.random_lock:
+            return self.random.random() < rate
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    """Request handler for ReplayServer, keeping connections alive like real hosts"""
+
+    protocol_version = "HTTP/1.1"
+    # Whether this connection has answered a request yet
+    handshaken = False
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Answer with the recorded page, shaped by the host's network settings"""
+        host = self.path.lstrip("/").split("/", 1)[0]
+        settings = self.server.shaping(host)
+        if not self.handshaken:
+            self.handshaken = True
+            time.sleep(settings["handshake"])
+        time.sleep(settings["latency"])
+
+        if self.server.should_fail(settings["failure_rate"]):
+            if settings["failure_status"] == "drop":
+                self.close_connection = True
+                return
+            self.send_error(settings["failure_status"])
+            return
+
+        entry = self.server.manifest.get(self.path.lstrip("/"))
+        if entry is None:
+            self.send_error(404)
+            return
+        with open(os.path.join(self.server.pages_dir, entry["file"]), "rb") as page:
+            body = page.read()
+        body, coding = self.server.encode(entry["file"], body,
+            self.headers.get("Accept-Encoding", ""))
+
+        self.send_response(200)
+        self.send_header("Content-Type", entry["content_type"])
+        if coding:
+            self.send_header("Content-Encoding", coding)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+
+        chunk_size = 16 * 1024
+        try:
+            for start in range(0, len(body), chunk_size):
+                chunk = body[start:start + chunk_size]
+                self.wfile.write(chunk)
+                if settings["bandwidth"]:
+                    time.sleep(len(chunk) / settings["bandwidth"])
+        except ConnectionError:
+            # The version check hangs up as soon as it has found the version
+            self.close_connection = True
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """GraphQL queries are answered with the recorded response too"""
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.do_GET()
+
+
+def run_once(server_url, engine, jobs=None):
+    """
+    Run the version check against the replay server, and return its wall
+    time, peak RSS in KiB and the per-tool timings it reported
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        timings_path = os.path.join(temp_dir, "timings.json")
+        env = dict(os.environ)
+        env.pop("GITHUB_TOKEN", None)
+        env.pop("GH_TOKEN", None)
+        start_time = time.perf_counter()
+        cmd = [sys.executable, VERSION_CHECK, "--no-cache", "--replay-url", server_url,
+            "--engine", engine, "--timings-json", timings_path]
+        if jobs:
+            cmd += ["--jobs", str(jobs)]
+        process = subprocess.Popen(  # pylint: disable=consider-using-with
+            cmd, stdout=subprocess.DEVNULL, env=env)
+        # wait4 gives the resource usage of this one child, workers included
+        _, status, rusage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        wall_time = time.perf_counter() - start_time
+        # Outdated or unreachable tools exit with 1 too, but only a finished
+        # check writes its timings
+        if process.returncode not in (0, 1) or not os.path.exists(timings_path):
+            sys.exit(f"The version check failed with exit status {process.returncode}")
+        with open(timings_path, "r", encoding="utf-8") as timings_file:
+            timings = json.load(timings_file)
+
+    return {
+        "wall_time": wall_time,
+        "max_rss_kib": rusage.ru_maxrss,
+        # CPU time, so the comparison isn't skewed by threads waiting on the GIL
+        "parse": {tool: tool_timings.get("parse_cpu", 0.0)
+            for tool, tool_timings in timings["tools"].items()},
+    }
+
+
+def startup_once(server_url, tool):
+    """
+    Check a single tool against the replay server under -X importtime, and
+    return its wall time, total import time and per-module import times
+    """
+    env = dict(os.environ)
+    env.pop("GITHUB_TOKEN", None)
+    env.pop("GH_TOKEN", None)
+    start_time = time.perf_counter()
+    output = subprocess.run([sys.executable, "-X", "importtime", VERSION_CHECK, "--no-cache",
+        "--replay-url", server_url, "--tool", tool],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, env=env, check=False)
+    wall_time = time.perf_counter() - start_time
+
+    modules = {}
+    for line in output.stderr.decode("utf-8", errors="replace").splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        # Nested imports are indented; only top-level ones add up to the total
+        modules[name.strip()] = {
+            "self": int(self_us) / 1e6,
+            "cumulative": int(cumulative_us) / 1e6,
+            "top_level": not name[1:].startswith(" "),
+        }
+    return {
+        "wall_time": wall_time,
+        "import_time": sum(module["cumulative"] for module in modules.values()
+            if module["top_level"]),
+        "modules": modules,
+    }
+
+
+def startup(server_url, tool, repeat):
+    """Medians of startup_once over repeat runs, with the imports of the last run"""
+    runs = [startup_once(server_url, tool) for _ in range(repeat)]
+    modules = runs[-1]["modules"]
+    return {
+        "runs": len(runs),
+        "tool": tool,
+        "wall_time": statistics.median(run["wall_time"] for run in runs),
+        "import_time": statistics.median(run["import_time"] for run in runs),
+        "slowest_imports": dict(sorted(((name, module["cumulative"])
+            for name, module in modules.items() if module["top_level"]),
+            key=lambda item: -item[1])[:10]),
+        "lazy_modules_imported": [name for name in LAZY_MODULES if name in modules],
+    }
+
+
+def startup_regressions(result, baseline, threshold):
+    """
+    Describe startup measurements that got worse than baseline, if there is
+    one, and modules that should be imported lazily but weren't
+    """
+    found = [f"{name} is imported at startup" for name in result["lazy_modules_imported"]]
+    if baseline:
+        found += [f"{metric}: {baseline[metric]:.3f}s -> {result[metric]:.3f}s"
+            for metric in ["wall_time", "import_time"]
+            if result[metric] > baseline[metric] * (1 + threshold)]
+    return found
+
+
+def summarize(runs):
+    """Medians over the runs, which are less sensitive to a noisy run than means"""
+    tools = runs[0]["parse"].keys()
+    return {
+        "runs": len(runs),
+        "wall_time": statistics.median(run["wall_time"] for run in runs),
+        "max_rss_kib": statistics.median(run["max_rss_kib"] for run in runs),
+        "parse": {tool: statistics.median(run["parse"][tool] for run in runs) for tool in tools},
+    }
+
+
+def regressions(result, baseline, threshold):
+    """Describe every measurement that got worse than baseline by more than threshold"""
+    found = []
+    if not baseline:
+        return found
+    for metric in ["wall_time", "max_rss_kib"]:
+        if result[metric] > baseline[metric] * (1 + threshold):
+            found.append(f"{metric}: {baseline[metric]:.3f} -> {result[metric]:.3f}")
+    for tool, parse_time in result["parse"].items():
+        baseline_time = baseline["parse"].get(tool)
+        if baseline_time is None or parse_time < PARSE_TIME_FLOOR:
+            continue
+        if parse_time > max(baseline_time, PARSE_TIME_FLOOR) * (1 + threshold):
+            found.append(f"{tool} parse: {baseline_time:.4f}s -> {parse_time:.4f}s")
+    return found
+
+
+def check_baseline(result, baseline_path, command_args, find_regressions):
+    """
+    Save result as the baseline with --save-baseline, otherwise report what
+    find_regressions finds against the saved baseline and exit with 1 if
+    anything regressed
+    """
+    if command_args.save_baseline:
+        with open(baseline_path, "w", encoding="utf-8") as baseline_file:
+            json.dump(result, baseline_file, indent=2, sort_keys=True)
+        print(f"Saved the baseline to {baseline_path}")
+        return
+
+    baseline = None
+    if os.path.exists(baseline_path):
+        with open(baseline_path, "r", encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+    found = find_regressions(result, baseline, command_args.threshold)
+    for regression in found:
+        print(f"Regression: {regression}")
+    if found:
+        sys.exit(1)
+    if baseline:
+        print("No regressions against the baseline.")
+
+
+def main():
+    """
+    Record vendor pages, or replay them from a local server and benchmark
+    the version check against them
+
+    Recordings and baselines are local to each machine and aren't committed,
+    so run the record command once before the first run or startup.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["record", "run", "startup"],
+        help="record: download the pages, run: benchmark against the recording, "
+            "startup: benchmark a single-tool check and its imports")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR,
+        help="Where the recorded pages and the baseline live (default: %(default)s)")
+    parser.add_argument("--network",
+        help="JSON file of per-host latency, bandwidth and failure injection")
+    parser.add_argument("--seed", type=int, default=0,
+        help="Seed for failure injection, so runs are reproducible")
+    parser.add_argument("--engine", choices=["threads", "pool"], default="threads",
+        help="Engine to benchmark")
+    parser.add_argument("--jobs", type=int,
+        help="Concurrency of the version check (default: its own default)")
+    parser.add_argument("--tool", default="zlib",
+        help="Tool the startup benchmark checks (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=5,
+        help="Number of runs to take the median of")
+    parser.add_argument("--threshold", type=float, default=0.2,
+        help="Fraction a measurement may grow over the baseline before it's a regression")
+    parser.add_argument("--save-baseline", action="store_true",
+        help="Store this result as the baseline to compare later runs against; run keeps "
+            "one per --engine and --jobs")
+    command_args = parser.parse_args()
+
+    pages_dir = os.path.join(command_args.data_dir, "pages")
+    if command_args.command == "record":
+        os.makedirs(pages_dir, exist_ok=True)
+        record(pages_dir)
+        return
+    if not os.path.isdir(pages_dir):
+        parser.error(f"There are no recorded pages in {command_args.data_dir}; "
+            "run the record command first")
+
+    network = {}
+    if command_args.network:
+        with open(command_args.network, "r", encoding="utf-8") as network_file:
+            network = json.load(network_file)
+
+    server = ReplayServer(pages_dir, network, command_args.seed)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        if command_args.command == "startup":
+            result = startup(server.url, command_args.tool, command_args.repeat)
+        else:
+            result = summarize([run_once(server.url, command_args.engine, command_args.jobs)
+                for _ in range(command_args.repeat)])
+    finally:
+        server.shutdown()
+
+    if command_args.command == "startup":
+        print(f"wall time of --tool {result['tool']} (median of {result['runs']}): "
+            f"{result['wall_time']:.3f}s")
+        print(f"import time (median): {result['import_time']:.3f}s")
+        print("slowest top-level imports:")
+        for name, seconds in result["slowest_imports"].items():
+            print(f"  {name}: {seconds:.4f}s")
+        check_baseline(result, os.path.join(command_args.data_dir, "startup_baseline.json"),
+            command_args, startup_regressions)
+        return
+
+    result["engine"] = command_args.engine
+    result["jobs"] = command_args.jobs
+    print(f"wall time (median of {result['runs']}): {result['wall_time']:.3f}s")
+    print(f"peak RSS (median): {result['max_rss_kib']:.0f} KiB")
+    print("parse CPU time (median):")
+    for tool, parse_time in sorted(result["parse"].items(), key=lambda item: -item[1]):
+        print(f"  {tool}: {parse_time:.4f}s")
+
+    # Engines and concurrency levels each get their own baseline, as their
+    # times aren't comparable with each other
+    setting = command_args.engine + (f"-j{command_args.jobs}" if command_args.jobs else "")
+    check_baseline(result, os.path.join(command_args.data_dir, f"baseline-{setting}.json"),
+        command_args, regressions)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,21 +5,1404 @@
 # pylint: disable=missing-function-docstring
 # pylint: disable=invalid-name
 # pylint: disable=R0904
+# pylint: disable=R0902
+# pylint: disable=too-many-lines
+# pylint: disable=import-outside-toplevel
 
 import argparse
+import codecs
+import contextlib
+import contextvars
+import functools
+import hashlib
+import http.client
+import http.cookiejar
+import json
+import os
+import random
 import re
+import socket
 import sys
+import threading
+import tempfile
 import time
-from multiprocessing import Pool
-from urllib.request import build_opener, HTTPCookieProcessor, install_opener, Request, urlopen
+import zlib
+from collections import Counter, deque, namedtuple
+from html.parser import HTMLParser
+from urllib.parse import unquote, urlsplit
+from urllib.request import (BaseHandler, build_opener, HTTPHandler, HTTPSHandler, Request,
+    urlopen)
 from urllib.error import HTTPError
 from urllib.error import URLError
-from bs4 import BeautifulSoup
 
 
+DEFAULT_JOBS = 16
+DEFAULT_TIMEOUT = 30
+DEFAULT_RETRIES = 2
+# First retry waits about this many seconds, doubling after that
+RETRY_BACKOFF = 0.5
+# Server errors that are worth trying again
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+# Requests in flight to one host at once, unless --host-limit says otherwise
+DEFAULT_HOST_LIMIT = 4
+# Seconds a kept-alive connection may sit idle before it's closed instead of reused
+KEEPALIVE_IDLE = 30
+# Bytes left in a body that are read out when it's closed early, to keep its connection
+DRAIN_LIMIT = 256 * 1024
+# A hedged request goes out once the first is this much slower than usual
+HEDGE_FACTOR = 2.0
+# How long past the run deadline the engines wait for a stuck tool
+DEADLINE_GRACE = 1.0
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser(os.path.join("~", ".cache"))),
+    "ssrobins-tools", "version-check")
+# Seconds between stack samples with --profiler sample
+SAMPLE_INTERVAL = 0.001
+# Bounds on how often --watch checks a tool, in seconds
+MIN_POLL_INTERVAL = 60 * 60
+MAX_POLL_INTERVAL = 7 * 24 * 60 * 60
+# A tool is checked about this many times in its usual time between releases
+POLLS_PER_RELEASE = 8
+# Longest the watcher sleeps at once, so it notices it's been stopped
+WATCH_TICK = 60
+# A tool failing this many checks in a row is skipped until its next probe
+BREAKER_THRESHOLD = 3
+# Seconds until the first probe of a skipped tool, doubling after every failed probe
+BREAKER_BACKOFF = 6 * 60 * 60
+MAX_BREAKER_BACKOFF = 7 * 24 * 60 * 60
+# Recent checks of each tool kept for its success rate and latency percentiles
+HEALTH_HISTORY = 20
+
+# A downloaded page; validator is the ETag or Last-Modified it was served with
+# and not_modified is set when the body came from the cache after a 304.
+Page = namedtuple("Page", ["body", "validator", "not_modified", "charset"])
+
+# An HTML element picked out of a page, with the text of all its descendants
+Element = namedtuple("Element", ["name", "attrs", "text"])
+
+# Elements that never have an end tag, so they never hold any text
+VOID_ELEMENTS = frozenset([
+    "area", "base", "br", "col", "embed", "hr", "img", "input",
+    "link", "meta", "param", "source", "track", "wbr",
+])
+
+# Tool whose extractor is running in the current thread, and the pages it read
+current_tool = contextvars.ContextVar("current_tool", default=None)
+current_pages = contextvars.ContextVar("current_pages", default=None)
+
+# Page streams opened by the fetch group running in the current thread
+current_streams = contextvars.ContextVar("current_streams", default=None)
+
+# time.monotonic() by which the tool running in the current thread must finish
+current_deadline = contextvars.ContextVar("current_deadline", default=None)
+
+# Seconds spent in each phase by the tool running in the current thread
+current_timings = contextvars.ContextVar("current_timings", default=None)
+
+# Order the phases of a version check are reported in
+PHASES = ["wait", "retry_wait", "dns", "connect", "tls", "ttfb", "download", "decompress",
+    "parse", "extract"]
+NETWORK_PHASES = ["wait", "retry_wait", "dns", "connect", "tls", "ttfb", "download"]
+
+
+@contextlib.contextmanager
+def timed(phase, cpu_phase=None):
+    """
+    Add the time spent in the block to phase for the current tool, and the
+    CPU time this thread spent in it to cpu_phase, which unlike wall time
+    doesn't grow while other threads hold the GIL
+    """
+    timings = current_timings.get()
+    start = time.perf_counter()
+    cpu_start = time.thread_time()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings[phase] = timings.get(phase, 0.0) + time.perf_counter() - start
+            if cpu_phase:
+                timings[cpu_phase] = (timings.get(cpu_phase, 0.0)
+                    + time.thread_time() - cpu_start)
+
+
+@contextlib.contextmanager
+def timed_apart(phase):
+    """
+    Add the time spent in the block to phase for the current tool, leaving
+    out the time it spent in other phases, like a generator that downloads
+    and parses the page as the block reads from it
+    """
+    timings = current_timings.get()
+    if timings is None:
+        yield
+        return
+    measured = sum(timings.get(other, 0.0) for other in PHASES)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        nested = sum(timings.get(other, 0.0) for other in PHASES) - measured
+        timings[phase] = timings.get(phase, 0.0) + max(time.perf_counter() - start - nested, 0.0)
+
+
+def timed_create_connection(address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT,
+    source_address=None):
+    # pylint: disable=protected-access
+    """socket.create_connection, with name lookup and connect timed separately"""
+    host, port = address
+    with timed("dns"):
+        addresses = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+    error = None
+    for family, socktype, proto, _, sockaddr in addresses:
+        sock = socket.socket(family, socktype, proto)
+        try:
+            if timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                sock.settimeout(timeout)
+            if source_address:
+                sock.bind(source_address)
+            with timed("connect"):
+                sock.connect(sockaddr)
+            return sock
+        except OSError as connect_error:
+            error = connect_error
+            sock.close()
+    raise error or OSError(f"getaddrinfo returned nothing for {host}")
+
+
+class TimedHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = timed_create_connection
+
+    def getresponse(self):
+        with timed("ttfb"):
+            return super().getresponse()
+
+
+class TimedHTTPSConnection(http.client.HTTPSConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = timed_create_connection
+
+    def connect(self):
+        # Whatever the TCP connect and name lookup didn't take was the handshake
+        timings = current_timings.get()
+        if timings is None:
+            super().connect()
+            return
+        before = timings.get("dns", 0.0) + timings.get("connect", 0.0)
+        start = time.perf_counter()
+        super().connect()
+        after = timings.get("dns", 0.0) + timings.get("connect", 0.0)
+        timings["tls"] = timings.get("tls", 0.0) + time.perf_counter() - start - (after - before)
+
+    def getresponse(self):
+        with timed("ttfb"):
+            return super().getresponse()
+
+
+class PooledHTTPResponse(http.client.HTTPResponse):
+    """HTTPResponse that hands its connection back to an HTTPClient when closed"""
+
+    on_release = None
+
+    def close(self):
+        # The connection can carry another request only if the body was read
+        # to the end; http.client drops fp as soon as it gets there. A short
+        # remainder is cheaper to read than a new connection.
+        if (self.on_release and self.fp is not None and not self.chunked
+            and self.length is not None and self.length <= DRAIN_LIMIT):
+            with contextlib.suppress(OSError, http.client.HTTPException):
+                self.read()
+        finished = self.fp is None or (not self.chunked and self.length == 0)
+        reusable = finished and not self.will_close
+        super().close()
+        release, self.on_release = self.on_release, None
+        if release:
+            release(reusable)
+
+
+class HTTPClient:
+    """
+    Keep-alive connections, a cookie jar and a cap on requests in flight for
+    each host, shared by every version check in this process
+
+    Requests wait for one of their host's slots, so a burst of checks against
+    github.com doesn't trip its secondary rate limits, and go out over a
+    connection an earlier response left open instead of handshaking again.
+    A slot is held until the response headers are in; bodies can be read as
+    slowly as the parser likes. limits maps host names to their cap, and None
+    to the cap for the rest. Hosts are the ones requests were made for,
+    before any redirect or --replay-url rewrite.
+    """
+
+    def __init__(self, limits):
+        self.limits = limits
+        self._lock = threading.Lock()
+        self._slots = {}
+        self._jars = {}
+        # Idle connections by (scheme, host:port, origin host), with when they
+        # went idle. The origin host keeps vendors apart under --replay-url,
+        # where they all share one host:port, as they would be on the web.
+        self._idle = {}
+        self._opener = build_opener(PooledHTTPHandler(self), PooledHTTPSHandler(self))
+        self._cookie_opener = build_opener(PooledHTTPHandler(self), PooledHTTPSHandler(self),
+            HostCookieProcessor(self))
+
+    def open(self, req, timeout, cookies=False):
+        opener = self._cookie_opener if cookies else self._opener
+        return opener.open(req, timeout=timeout)
+
+    def slots(self, host):
+        with self._lock:
+            if host not in self._slots:
+                self._slots[host] = threading.BoundedSemaphore(
+                    self.limits.get(host, self.limits[None]))
+            return self._slots[host]
+
+    def cookie_jar(self, host):
+        with self._lock:
+            return self._jars.setdefault(host, http.cookiejar.CookieJar())
+
+    def _checkout(self, key):
+        """An idle connection to key, closing any that have been idle too long"""
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while idle:
+                connection, idle_since = idle.pop()
+                if time.monotonic() - idle_since < KEEPALIVE_IDLE:
+                    return connection
+                connection.close()
+        return None
+
+    def _release(self, key, connection, reusable):
+        if reusable:
+            with self._lock:
+                self._idle.setdefault(key, []).append((connection, time.monotonic()))
+        else:
+            connection.close()
+
+    def _send(self, req, connect, headers, timeout):
+        key = (req.type, req.host, req.origin_req_host)
+        while True:
+            connection = self._checkout(key)
+            reused = connection is not None
+            if reused:
+                connection.timeout = timeout
+                if connection.sock:
+                    connection.sock.settimeout(timeout)
+            else:
+                connection = connect(timeout=req.timeout)
+                connection.response_class = PooledHTTPResponse
+            try:
+                connection.request(req.get_method(), req.selector, req.data, headers,
+                    encode_chunked=req.has_header("Transfer-encoding"))
+                response = connection.getresponse()
+            except ConnectionError as error:
+                connection.close()
+                # The server hung up on an idle connection, so try a fresh one
+                if not reused:
+                    raise URLError(error) from error
+                continue
+            except OSError as error:
+                connection.close()
+                raise URLError(error) from error
+            except http.client.HTTPException:
+                connection.close()
+                raise
+            response.on_release = functools.partial(self._release, key, connection)
+            return response
+
+    def request(self, req, connect, headers):
+        """
+        Send req over a pooled connection, or one made with connect, once its
+        host has a slot free, and return the response
+        """
+        timeout = req.timeout if isinstance(req.timeout, (int, float)) else None
+        slots = self.slots(req.origin_req_host)
+        with timed("wait"):
+            if not slots.acquire(timeout=timeout):
+                raise TimeoutError(f"No request to {req.origin_req_host} finished in time")
+        try:
+            response = self._send(req, connect, headers, timeout)
+        finally:
+            slots.release()
+        response.url = req.get_full_url()
+        response.msg = response.reason
+        return response
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection, _ in connections:
+                connection.close()
+
+
+class PooledHandlerMixin:  # pylint: disable=too-few-public-methods
+    """do_open for urllib's HTTP handlers that goes through an HTTPClient"""
+
+    def __init__(self, client):
+        super().__init__()
+        self.client = client
+
+    def do_open(self, http_class, req, **http_conn_args):
+        # pylint: disable=protected-access
+        if req._tunnel_host:
+            # Connections tunnelled through a proxy aren't worth pooling
+            return super().do_open(http_class, req, **http_conn_args)
+        if not req.host:
+            raise URLError("no host given")
+        headers = dict(req.unredirected_hdrs)
+        headers.update((name, value) for name, value in req.headers.items()
+            if name not in headers)
+        headers = {name.title(): value for name, value in headers.items()}
+        return self.client.request(req,
+            functools.partial(http_class, req.host, **http_conn_args), headers)
+
+
+class PooledHTTPHandler(PooledHandlerMixin, HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(TimedHTTPConnection, req)
+
+
+class PooledHTTPSHandler(PooledHandlerMixin, HTTPSHandler):
+    def https_open(self, req):
+        return self.do_open(TimedHTTPSConnection, req, context=self._context)
+
+
+class HostCookieProcessor(BaseHandler):
+    """Like HTTPCookieProcessor, but with an HTTPClient's cookie jar for each host"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def http_request(self, request):
+        self.client.cookie_jar(request.origin_req_host).add_cookie_header(request)
+        return request
+
+    def http_response(self, request, response):
+        self.client.cookie_jar(request.origin_req_host).extract_cookies(response, request)
+        return response
+
+    https_request = http_request
+    https_response = http_response
+
+
+def timing_report(tools, results, count=5):
+    """Lines summarising the slowest tools and the phases the run spent most time in"""
+    timings = {tool: result.get("timings", {}) for tool, result in zip(tools, results)}
+    lines = [f"Slowest {min(count, len(timings))} tools:"]
+    for tool in sorted(timings, key=lambda tool: -timings[tool].get("total", 0.0))[:count]:
+        # CPU times like parse_cpu overlap the phase they were measured in
+        phases = sorted(((timings[tool][phase], phase) for phase in PHASES
+            if phase in timings[tool]), reverse=True)
+        breakdown = ", ".join(f"{phase} {seconds:.3f}s" for seconds, phase in phases[:3])
+        lines.append(f"  {tool}: {timings[tool].get('total', 0.0):.3f}s ({breakdown})")
+    totals = {phase: sum(timing.get(phase, 0.0) for timing in timings.values())
+        for phase in PHASES}
+    lines.append("Time per phase, summed over all tools:")
+    for phase in sorted(totals, key=lambda phase: -totals[phase]):
+        lines.append(f"  {phase}: {totals[phase]:.3f}s")
+    return lines
+
+
+# Human-readable line for each status a tool can end up in
+STATUS_MESSAGES = {
+    "outdated": "{tool} {current} can be upgraded to {latest}.",
+    "not-found": "{tool} version could not be found. Check the website.",
+    "unreachable": "{tool} website could not be loaded.",
+    "timeout": "{tool} website timed out.",
+    "stale": "{tool} status is out of date. Is the watcher running?",
+    "missing": "{tool} was not checked by any shard.",
+    "skipped": "{tool} keeps failing, so it wasn't checked.",
+}
+
+
+def describe(tool, result):
+    """Lines telling a person how a tool's check turned out"""
+    lines = []
+    if result["status"] in STATUS_MESSAGES:
+        lines.append(STATUS_MESSAGES[result["status"]].format(tool=tool,
+            current=result["current"], latest=result["latest"]))
+    if "details" in result:
+        lines.append(f"  Details: {result['details']}")
+    return lines
+
+
+def result_record(tool, result):
+    """One JSON-lines record for a tool's check"""
+    record = {
+        "tool": tool,
+        "current": result["current"],
+        "latest": result["latest"],
+        "status": result["status"],
+        "elapsed": round(result["timings"].get("total", 0.0), 6),
+    }
+    if "details" in result:
+        record["details"] = result["details"]
+    return record
+
+
+def smooth(average, sample, weight=0.3):
+    """Exponential moving average of sample into average, which may not exist yet"""
+    return sample if average is None else (1 - weight) * average + weight * sample
+
+
+class CachedVersion(Exception):
+    """Raised to skip parsing when a tool's page hasn't changed since the last run"""
+
+    def __init__(self, version):
+        super().__init__(version)
+        self.version = version
+
+
+class Strainer:
+    """
+    Match elements by tag name and attributes, like bs4's SoupStrainer
+
+    An attribute can be matched by an exact string, a compiled regex (searched)
+    or a callable that gets the value, or None if the attribute is missing.
+    Like bs4, "class" also matches any one of its space-separated values.
+    """
+
+    def __init__(self, name=None, attrs=None):
+        self.name = name
+        self.attrs = attrs or {}
+
+    @staticmethod
+    def match_value(expected, value):
+        if callable(expected) and not isinstance(expected, re.Pattern):
+            return bool(expected(value))
+        if value is None:
+            return False
+        if isinstance(expected, re.Pattern):
+            return expected.search(value) is not None
+        return value == expected
+
+    def match(self, name, attrs):
+        if self.name and name != self.name:
+            return False
+        for attr, expected in self.attrs.items():
+            value = attrs.get(attr)
+            if attr == "class" and value:
+                candidates = [value] + value.split()
+                if not any(self.match_value(expected, candidate) for candidate in candidates):
+                    return False
+            elif not self.match_value(expected, value):
+                return False
+        return True
+
+
+class ElementStream(HTMLParser):
+    """
+    Incremental parser that only keeps the elements a Strainer matches
+
+    Feed it text as it arrives and collect finished elements with pop(), in
+    document order. End tags close elements the way bs4's html.parser builder
+    does: they pop back to the nearest open tag of the same name.
+    """
+
+    def __init__(self, strainer):
+        super().__init__(convert_charrefs=True)
+        self.strainer = strainer
+        self._open_tags = []
+        # Matched elements in start order: [depth, name, attrs, text parts, closed]
+        self._captures = deque()
+        # The captures still open, innermost last, so only they see new text
+        self._active = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = {name: value or "" for name, value in attrs}
+        if self.strainer.match(tag, attrs):
+            capture = [len(self._open_tags), tag, attrs, [], tag in VOID_ELEMENTS]
+            self._captures.append(capture)
+            if not capture[4]:
+                self._active.append(capture)
+        if tag not in VOID_ELEMENTS:
+            self._open_tags.append(tag)
+
+    def handle_endtag(self, tag):
+        if tag in VOID_ELEMENTS or tag not in self._open_tags:
+            return
+        depth = len(self._open_tags) - 1 - self._open_tags[::-1].index(tag)
+        del self._open_tags[depth:]
+        while self._active and self._active[-1][0] >= depth:
+            self._active.pop()[4] = True
+
+    def handle_data(self, data):
+        for capture in self._active:
+            capture[3].append(data)
+
+    def close(self):
+        super().close()
+        for capture in self._active:
+            capture[4] = True
+        self._active = []
+
+    def pop(self):
+        elements = []
+        while self._captures and self._captures[0][4]:
+            _, name, attrs, text, _ = self._captures.popleft()
+            elements.append(Element(name, attrs, "".join(text)))
+        return elements
+
+
+@functools.cache
+def brotli_module():
+    """brotli, or brotlicffi which has the same API, or None if neither is installed"""
+    try:
+        import brotli
+    except ImportError:
+        try:
+            import brotlicffi as brotli
+        except ImportError:
+            return None
+    return brotli
+
+
+def accept_encoding():
+    """Accept-Encoding for page requests: every coding DecodedBody can undo here"""
+    return "gzip, deflate, br" if brotli_module() else "gzip, deflate"
+
+
+class ZlibDecoder:
+    """Incremental gzip or deflate decoder that hands out a bounded amount at a time"""
+
+    def __init__(self, wbits):
+        self._decompressor = zlib.decompressobj(wbits)
+        self._input = b""
+
+    @property
+    def eof(self):
+        return self._decompressor.eof
+
+    def feed(self, data):
+        self._input += data
+
+    def read(self, size):
+        try:
+            chunk = self._decompressor.decompress(self._input, size)
+        except zlib.error as error:
+            raise URLError(f"Couldn't decode the page: {error}") from error
+        self._input = self._decompressor.unconsumed_tail
+        return chunk
+
+    def flush(self):
+        try:
+            return self._decompressor.flush()
+        except zlib.error as error:
+            raise URLError(f"Couldn't decode the page: {error}") from error
+
+
+class BrotliDecoder:
+    """Incremental brotli decoder with the same interface as ZlibDecoder"""
+
+    def __init__(self):
+        self._decompressor = brotli_module().Decompressor()
+        self._input = b""
+        # Output past what the last read asked for; the limit is only rough
+        self._output = b""
+        # Only newer brotli releases can bound how much one call decodes
+        self._bounded = hasattr(self._decompressor, "can_accept_more_data")
+
+    @property
+    def eof(self):
+        return self._decompressor.is_finished() and not self._output
+
+    def feed(self, data):
+        self._input += data
+
+    def read(self, size):
+        if not self._output:
+            limit = {"output_buffer_limit": size} if self._bounded else {}
+            data = b""
+            if not self._bounded or self._decompressor.can_accept_more_data():
+                data, self._input = self._input, b""
+            try:
+                self._output = self._decompressor.process(data, **limit)
+            except brotli_module().error as error:
+                raise URLError(f"Couldn't decode the page: {error}") from error
+        chunk, self._output = self._output[:size], self._output[size:]
+        return chunk
+
+    @staticmethod
+    def flush():
+        return b""
+
+
+class DecodedBody:
+    """
+    A response body with its Content-Encoding undone as it's read
+
+    No more is decoded at once than the reader asks for, so a reader that
+    stops early, because it has found what it's after, doesn't pay to
+    decompress or parse the rest of a page that compressed well.
+    """
+
+    def __init__(self, response):
+        self._response = response
+        coding = response.headers.get("Content-Encoding", "identity").strip().lower()
+        if coding in ("gzip", "x-gzip"):
+            self._decoder = ZlibDecoder(16 + zlib.MAX_WBITS)
+        elif coding == "deflate":
+            self._decoder = ZlibDecoder(zlib.MAX_WBITS)
+        elif coding == "br" and brotli_module():
+            self._decoder = BrotliDecoder()
+        elif coding in ("", "identity"):
+            self._decoder = None
+        else:
+            response.close()
+            raise URLError(f"Unsupported Content-Encoding: {coding}")
+        self._input_done = False
+
+    @property
+    def done(self):
+        """Whether the whole body has been read, so the next read is empty"""
+        return self._input_done and (self._decoder is None or self._decoder.eof)
+
+    def read(self, size):
+        """Up to size bytes of the decoded body, or b"" at its end"""
+        while True:
+            if self._decoder:
+                chunk = self._decode(size)
+                if chunk or self._input_done:
+                    return chunk
+            elif self._input_done:
+                return b""
+            with timed("download"):
+                data = self._response.read(size)
+            # http.client drops the connection as soon as the last byte is
+            # read; closing the response then hands it back for reuse
+            if not data or self._response.isclosed():
+                self._input_done = True
+                self._response.close()
+            if not self._decoder:
+                return data
+            self._decoder.feed(data)
+
+    def _decode(self, size):
+        with timed("decompress"):
+            chunk = self._decoder.read(size)
+            if not chunk and self._input_done:
+                chunk = self._decoder.flush()
+        return chunk
+
+    def close(self):
+        self._response.close()
+
+
+class PageStream:
+    """
+    A page body that is only read from the socket as far as its readers need
+
+    Any number of readers can iterate chunks() from the start; chunks already
+    read are replayed from memory and the next one is read, and decoded, on
+    demand. Once the body has been read to the end, on_complete gets the
+    whole of it, decoded.
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, response=None, *, body=None, validator=None, not_modified=False,
+        charset=None, on_complete=None):
+        # pylint: disable=too-many-arguments
+        self._lock = threading.Lock()
+        self._chunks = [body] if body else []
+        self._body = DecodedBody(response) if response is not None else None
+        self._on_complete = on_complete
+        self.has_body = response is not None or body is not None
+        self.validator = validator
+        self.not_modified = not_modified
+        self.charset = charset or "utf-8"
+
+    def chunks(self):
+        index = 0
+        while True:
+            deadline = current_deadline.get()
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError("The deadline passed while reading the page")
+            with self._lock:
+                if index == len(self._chunks) and not self._read_chunk():
+                    return
+                chunk = self._chunks[index]
+            index += 1
+            yield chunk
+
+    def _read_chunk(self):
+        if self._body is None:
+            return False
+        chunk = self._body.read(self.CHUNK_SIZE)
+        if chunk:
+            self._chunks.append(chunk)
+        # Finish as soon as the last chunk is in, which may be before anyone
+        # asks for another
+        if not chunk or self._body.done:
+            self._body.close()
+            self._body = None
+            if self._on_complete:
+                self._on_complete(b"".join(self._chunks))
+        return bool(chunk)
+
+    def read(self):
+        for _ in self.chunks():
+            pass
+        return b"".join(self._chunks)
+
+    def close(self):
+        with self._lock:
+            if self._body is not None:
+                self._body.close()
+                self._body = None
+
+
+def iter_elements(page, strainer):
+    """Yield elements matching strainer from a PageStream as its body arrives"""
+    try:
+        decoder = codecs.getincrementaldecoder(page.charset)(errors="replace")
+    except LookupError:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    parser = ElementStream(strainer)
+    for chunk in page.chunks():
+        with timed("parse", "parse_cpu"):
+            parser.feed(decoder.decode(chunk))
+        yield from parser.pop()
+    with timed("parse", "parse_cpu"):
+        parser.feed(decoder.decode(b"", final=True))
+        parser.close()
+    yield from parser.pop()
+
+
+class SingleFlight:
+    """
+    Share one in-flight computation per key between concurrent callers
+
+    The first caller to claim a key does the work and resolves or rejects it;
+    everyone else blocks until then and gets the same value or error.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+        self._errors = {}
+        self._pending = {}
+
+    def claim(self, key):
+        """
+        Return (True, None) if the caller owns the key and must resolve it,
+        otherwise wait for the owner and return (False, value)
+        """
+        with self._lock:
+            if key in self._values:
+                return False, self._values[key]
+            if key in self._errors:
+                reason, timeout = self._errors[key]
+                raise TimeoutError(reason) if timeout else URLError(reason)
+            event = self._pending.get(key)
+            if event is None:
+                self._pending[key] = threading.Event()
+                return True, None
+        event.wait()
+        return self.claim(key)
+
+    def resolve(self, key, value):
+        with self._lock:
+            self._values[key] = value
+            self._pending.pop(key).set()
+
+    def reject(self, key, reason, timeout=False):
+        # Only the message, and whether it was a timeout, is kept so the
+        # error can cross process boundaries
+        with self._lock:
+            self._errors[key] = (reason, timeout)
+            self._pending.pop(key).set()
+
+
+def single_flight(store, key, func):
+    """
+    Return the value of func() for key, computing it only once across all
+    callers sharing the store (which may be a proxy to another process)
+    """
+    with timed("wait"):
+        owner, value = store.claim(key)
+    if not owner:
+        return value
+    try:
+        value = func()
+    except (HTTPError, URLError) as error:
+        store.reject(key, str(error), isinstance(getattr(error, "reason", None), TimeoutError))
+        raise
+    except TimeoutError as error:
+        store.reject(key, str(error) or "timed out while fetching the page", True)
+        raise
+    except BaseException:
+        store.reject(key, "failed while fetching the page")
+        raise
+    store.resolve(key, value)
+    return value
+
+
+@functools.lru_cache(maxsize=None)
+def script_fingerprint():
+    """
+    Hash of this script, which holds every extractor, leaving out the table
+    of current versions so bumping one doesn't throw away every stored result
+    """
+    with open(__file__, "r", encoding="utf-8") as script_file:
+        source = script_file.read()
+    source = re.sub(r"self\.versions = \{\n.*?\n        \}\n", "", source, count=1,
+        flags=re.DOTALL)
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+
+class DiskCache:
+    """
+    Pages, their validators and the versions extracted from them, kept on
+    disk between runs so unchanged pages can be revalidated with a 304, and
+    the health of each tool's checks
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    @staticmethod
+    def page_id(key):
+        return hashlib.sha256(repr(key).encode("utf-8")).hexdigest()
+
+    def _path(self, *parts):
+        return os.path.join(self.cache_dir, *parts)
+
+    def _read_json(self, path):
+        try:
+            with open(path, "r", encoding="utf-8") as json_file:
+                return json.load(json_file)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, path, data):
+        # Write to a temporary file first so concurrent runs and workers
+        # never see a half-written entry
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as temp_file:
+                temp_file.write(data)
+            os.replace(temp_path, path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def load_page(self, key):
+        page_id = self.page_id(key)
+        entry = self._read_json(self._path("pages", f"{page_id}.json"))
+        if not entry:
+            return None
+        try:
+            with open(self._path("pages", f"{page_id}.html"), "rb") as body_file:
+                entry["body"] = body_file.read()
+        except OSError:
+            # Readers stopped before the end of the page last time
+            entry["body"] = None
+        return entry
+
+    def store_page(self, key, headers, charset, latency):
+        page_id = self.page_id(key)
+        entry = {
+            "url": key[0],
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "charset": charset,
+            "latency": latency,
+        }
+        try:
+            os.remove(self._path("pages", f"{page_id}.html"))
+        except OSError:
+            pass
+        self._write(self._path("pages", f"{page_id}.json"), json.dumps(entry).encode("utf-8"))
+        return entry
+
+    def store_latency(self, key, latency):
+        path = self._path("pages", f"{self.page_id(key)}.json")
+        entry = self._read_json(path)
+        if entry:
+            entry["latency"] = latency
+            self._write(path, json.dumps(entry).encode("utf-8"))
+
+    def store_body(self, key, body):
+        self._write(self._path("pages", f"{self.page_id(key)}.html"), body)
+
+    def load_result(self, tool):
+        # A result found by another version of the extractors may be wrong now
+        entry = self._read_json(self._path("tools", f"{tool}.json"))
+        return entry if entry and entry.get("script") == script_fingerprint() else None
+
+    def store_result(self, tool, version, pages):
+        entry = {"version": version, "pages": pages, "script": script_fingerprint()}
+        self._write(self._path("tools", f"{tool}.json"), json.dumps(entry).encode("utf-8"))
+
+    def load_health(self, tool):
+        return self._read_json(self._path("health", f"{tool}.json")) or {}
+
+    def store_health(self, tool, health):
+        self._write(self._path("health", f"{tool}.json"), json.dumps(health).encode("utf-8"))
+
+
+class GitHubBackend:
+    """
+    Where and how to look up GitHub releases
+
+    With a token, the releases of every repo are fetched in one GraphQL query;
+    without one, each repo's releases Atom feed is read instead. The URLs can
+    point at a local stand-in server for testing.
+    """
+
+    RELEASE_COUNT = 30
+
+    def __init__(self, url="https://github.com", api_url="https://api.github.com", token=None):
+        self.url = url.rstrip("/")
+        self.api_url = api_url.rstrip("/")
+        self.token = token
+
+    def feed_url(self, repo):
+        return f"{self.url}/{repo}/releases.atom"
+
+    def graphql_request(self, repos):
+        queries = []
+        for index, repo in enumerate(repos):
+            owner, name = repo.split("/")
+            queries.append(
+                f"r{index}: repository(owner: {json.dumps(owner)}, name: {json.dumps(name)}) {{"
+                f" releases(first: {self.RELEASE_COUNT},"
+                " orderBy: {field: CREATED_AT, direction: DESC}) {"
+                " nodes { tagName isDraft isPrerelease } } }")
+        body = json.dumps({"query": "query { " + " ".join(queries) + " }"})
+        return Request(f"{self.api_url}/graphql", data=body.encode("utf-8"), headers={
+            "Authorization": f"bearer {self.token}",
+            "Content-Type": "application/json",
+        })
+
+    @staticmethod
+    def graphql_tags(response, repos):
+        """Map each repo to its published release tags, newest first"""
+        data = response.get("data") or {}
+        tags = {}
+        for index, repo in enumerate(repos):
+            repository = data.get(f"r{index}")
+            if repository is None:
+                continue
+            tags[repo] = [release["tagName"] for release in repository["releases"]["nodes"]
+                if not release["isDraft"] and not release["isPrerelease"]]
+        return tags
+
+
+def pool_context():
+    """
+    Multiprocessing context for the pool engine, chosen so workers never
+    import this module again: forked workers already have it, otherwise a
+    fork server imports it once and forks every worker from there
+    """
+    import multiprocessing
+    start_methods = multiprocessing.get_all_start_methods()
+    if multiprocessing.get_start_method() == "fork" or "forkserver" not in start_methods:
+        return multiprocessing.get_context()
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload([__name__])
+    return context
+
+
+def __getattr__(name):
+    """
+    Define PageStoreManager on first use, so multiprocessing.managers is only
+    imported by the pool engine while the class still pickles by reference
+    for the fork server
+    """
+    if name != "PageStoreManager":
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    from multiprocessing.managers import BaseManager
+
+    class PageStoreManager(BaseManager):
+        """Manager serving a SingleFlight page store that Pool workers share"""
+
+    PageStoreManager.__qualname__ = name
+    PageStoreManager.register("SingleFlight", SingleFlight)
+    globals()[name] = PageStoreManager
+    return PageStoreManager
+
+
+def page_store_manager(context):
+    """Manager serving a SingleFlight page store that Pool workers share"""
+    return sys.modules[__name__].PageStoreManager(ctx=context)
+
+
+
+class PageExtractor:
+    """
+    How to find a tool's latest version on a web page
+
+    The page at url is streamed through a Strainer built from name and attrs.
+    pick chooses one element from the matches (the first by default) and
+    version turns its text into the version string. If nothing is picked,
+    fallback, another PageExtractor, gets a go.
+    """
+
+    def __init__(self, url, name=None, attrs=None, *, headers=None, cookies=False,
+        pick=None, version=None, fallback=None):
+        # pylint: disable=too-many-arguments
+        self.url = url
+        self.headers = headers or {}
+        self.cookies = cookies
+        self.strainer = Strainer(name, attrs)
+        self.pick = pick or first
+        self.version = version or (lambda text: text)
+        self.fallback = fallback
+
+    def host(self, github):
+        # pylint: disable=unused-argument
+        return urlsplit(self.url).hostname
+
+    def fetch_key(self, github):
+        # pylint: disable=unused-argument
+        return VersionCheck.page_key(self.url, self.headers, self.cookies)
+
+    def latest_version(self, version_check):
+        page = version_check.open_page(self.url, self.headers, self.cookies)
+        with timed_apart("extract"):
+            element = self.pick(iter_elements(page, self.strainer))
+        if element is None and self.fallback:
+            return self.fallback.latest_version(version_check)
+        with timed("extract"):
+            return self.version(element.text)
+
+
+class GitHubRelease:
+    """A tool whose latest version is the newest release tag matching tag_pattern"""
+
+    def __init__(self, repo, tag_pattern):
+        self.repo = repo
+        self._tag_pattern = tag_pattern
+
+    # The regexes are compiled on first use, so a single-tool run doesn't pay
+    # for every GitHub tool's
+    @functools.cached_property
+    def tag_pattern(self):
+        return re.compile(self._tag_pattern)
+
+    @functools.cached_property
+    def tag_link(self):
+        return re.compile(rf"/{re.escape(self.repo)}/releases/tag/([^/]+)$")
+
+    @functools.cached_property
+    def feed_strainer(self):
+        return Strainer("link", {"href": self.tag_link})
+
+    def host(self, github):
+        return urlsplit(github.api_url if github.token else github.url).hostname
+
+    def fetch_key(self, github):
+        # With a token every GitHub tool shares the one batched query
+        if github.token:
+            return ("github-graphql",)
+        return VersionCheck.page_key(github.feed_url(self.repo))
+
+    def latest_version(self, version_check):
+        with timed_apart("extract"):
+            for tag in version_check.github_release_tags(self):
+                result = self.tag_pattern.match(tag)
+                if result:
+                    return result.group(1)
+        raise AttributeError(f"No {self.repo} release tag matches {self.tag_pattern.pattern}")
+
+
+def first(elements):
+    return next(elements, None)
+
+
+def containing(text):
+    """Pick the first element whose text contains text"""
+    return lambda elements: next((element for element in elements if text in element.text), None)
+
+
+def following(text):
+    """Pick the element right after the first one whose text contains text"""
+    def pick(elements):
+        for element in elements:
+            if text in element.text:
+                return next(elements, None)
+        return None
+    return pick
+
+
+def word(index, chars=None):
+    """Version is the index-th word of the text, with chars stripped from it"""
+    return lambda text: text.split()[index].strip(chars)
+
+
+def search(pattern, default=""):
+    """Version is the first group of pattern searched in the text, or default"""
+    pattern = re.compile(pattern)
+
+    def version(text):
+        result = pattern.search(text)
+        return result.group(1) if result else default
+    return version
+
+
+def bzip2_version(text):
+    for line in text.splitlines():
+        if "The current stable version" in line:
+            return line.split()[-1].strip(".")
+    raise AttributeError("The current stable version isn't listed")
+
+
+BROWSER_HEADERS = {"User-Agent": "Mozilla/72 (X11; Linux i686)"}
+SHORT_BROWSER_HEADERS = {"User-Agent": "Mozilla/72"}
+SEMVER_TAG = r"^v(\d+\.\d+\.\d+)$"
+SDL_TAG = r"^release-(\d+\.\d+\.\d+)$"
+
+# Where each tool's latest version comes from. Everything here is built once
+# when the script loads, apart from the GitHub tag regexes.
+EXTRACTORS = {
+    "7Zip": PageExtractor("https://www.7-zip.org/", "b",
+        pick=containing("Download"), version=word(2)),
+    "AndroidNDK": PageExtractor("https://developer.android.com/ndk/downloads/",
+        "h2", {"id": "lts-downloads"}, version=word(-1, "()")),
+    "AndroidSDKAPI": PageExtractor(
+        "https://developer.android.com/guide/topics/manifest/uses-sdk-element",
+        "a", {"href": re.compile(r"^/sdk/api_diff/\d+/changes$")}),
+    "AndroidStudio": PageExtractor("https://developer.android.com/studio/releases",
+        "h1", {"class": "devsite-page-title"},
+        headers=BROWSER_HEADERS, cookies=True, version=word(-1)),
+    "box2d": GitHubRelease("erincatto/box2d", SEMVER_TAG),
+    "bzip2": PageExtractor("https://sourceware.org/bzip2/",
+        "td", {"colspan": "2"}, version=bzip2_version),
+    "cmake": PageExtractor("https://cmake.org/download/",
+        "h2", {"id": "latest"}, headers=BROWSER_HEADERS, cookies=True, version=word(2, "()")),
+    "conan": GitHubRelease("conan-io/conan", r"^(2\.\d+\.\d+)$"),
+    "freetype": PageExtractor("https://sourceforge.net/projects/freetype/files/freetype2/",
+        "a", {"href": lambda L: L and L.startswith("/projects/freetype/files/freetype2/")},
+        version=str.strip),
+    "GIMP": PageExtractor("https://www.gimp.org/", "span", {"id": "ver"}),
+    "git": PageExtractor("https://git-scm.com/download",
+        "span", {"class": "version"}, headers=SHORT_BROWSER_HEADERS, version=str.strip),
+    "glew": GitHubRelease("nigels-com/glew", r"^glew-(\d+\.\d+\.\d+)$"),
+    "googletest": GitHubRelease("google/googletest", SEMVER_TAG),
+    "Gradle": PageExtractor("https://gradle.org/install/", "p",
+        version=search(r"(?:^|\s)((?:\d+\.){1,2}\d+)")),
+    "grepWin": GitHubRelease("stefankueng/grepWin", r"^(\d+\.\d+\.\d+)$"),
+    "KeePassXC": GitHubRelease("keepassxreboot/keepassxc", r"^(\d+\.\d+\.\d+)$"),
+    "libpng": PageExtractor("http://www.libpng.org/pub/png/libpng.html",
+        "font", {"size": "+1"}, version=str.strip),
+    "MuseScore": GitHubRelease("musescore/MuseScore", SEMVER_TAG),
+    "ninja": GitHubRelease("ninja-build/ninja", SEMVER_TAG),
+    "NotepadPlusPlus": GitHubRelease("notepad-plus-plus/notepad-plus-plus", SEMVER_TAG),
+    "OBS": PageExtractor("https://obsproject.com/download",
+        "span", {"class": "dl_ver"}, version=lambda text: text.replace(" ", "").split(":")[1]),
+    "ogg": PageExtractor("https://xiph.org/downloads/",
+        "a", {"href": re.compile(
+            r"^https://downloads.xiph.org/releases/ogg/libogg-\d+\.\d+\.\d+\.tar.gz$")},
+        version=search(r"^libogg-(\d+\.\d+\.\d+)\.tar\.gz$")),
+    "python": PageExtractor("https://www.python.org/",
+        "a", {"href": lambda L: L and L.startswith("/downloads/release/python-")},
+        version=word(1)),
+    "SDL": GitHubRelease("libsdl-org/SDL", SDL_TAG),
+    "SDL_image": GitHubRelease("libsdl-org/SDL_image", SDL_TAG),
+    "SDL_mixer": GitHubRelease("libsdl-org/SDL_mixer", SDL_TAG),
+    "SDL_ttf": GitHubRelease("libsdl-org/SDL_ttf", SDL_TAG),
+    "SFML": PageExtractor("https://www.sfml-dev.org/download.php",
+        "div", {"class": "title"}, version=word(-1)),
+    "vorbis": PageExtractor("https://xiph.org/downloads/", "td", pick=following("libvorbis")),
+    "VS2022": PageExtractor(
+        "https://docs.microsoft.com/en-us/visualstudio/releases/2022/release-notes",
+        "a", {"href": re.compile(r"^#\d+\.\d+\.\d+$")}, version=word(4),
+        fallback=PageExtractor(
+            "https://docs.microsoft.com/en-us/visualstudio/releases/2022/release-notes",
+            "h2", {"id": re.compile(r"^\d+--visual-studio-\d+-version-\d+$")},
+            version=word(-1))),
+    "Xcode": PageExtractor("https://apps.apple.com/us/app/xcode/id497799835",
+        "p", {"class": "l-column small-6 medium-12 whats-new__latest__version"},
+        headers=SHORT_BROWSER_HEADERS, version=word(1)),
+    "zlib": PageExtractor("https://zlib.net/", "font", {"size": "+2"}, version=word(1)),
+}
+
+
+class StackSampler:
+    """
+    Sample the stacks of threads running version checks, for --profiler sample
+
+    One background thread per process samples every registered thread, and
+    credits each stack with the time since the last round of samples. While
+    no thread is registered it sleeps until the next start instead of
+    waking up every interval.
+    Stacks are (file, first line, function) per frame, outermost first,
+    starting from the innermost call of the root function a thread registered
+    with.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._threads = {}
+        self._busy = threading.Event()
+        self._thread = None
+
+    def start(self, root):
+        """Start sampling the calling thread's stacks below calls to root"""
+        with self._lock:
+            self._threads[threading.get_ident()] = (root.__code__, Counter())
+            self._busy.set()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="stack-sampler",
+                    daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        """Stop sampling the calling thread, returning its seconds by stack"""
+        with self._lock:
+            samples = self._threads.pop(threading.get_ident())[1]
+            if not self._threads:
+                self._busy.clear()
+            return samples
+
+    def _run(self):
+        last = time.perf_counter()
+        while True:
+            if not self._busy.is_set():
+                self._busy.wait()
+                last = time.perf_counter()
+            time.sleep(self.interval)
+            now = time.perf_counter()
+            frames = sys._current_frames()  # pylint: disable=protected-access
+            with self._lock:
+                for thread_id, (root, samples) in self._threads.items():
+                    stack = []
+                    frame = frames.get(thread_id)
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                        if code is root:
+                            break
+                        frame = frame.f_back
+                    samples[tuple(reversed(stack))] += now - last
+            last = now
+
+
+class SharedProfile:
+    """
+    One cProfile profiler for every thread checking a tool, for Python 3.12
+    and later, where a profiler sees every thread and only one can be active
+    in a process at a time
+
+    It runs while any thread is between start and stop. The thread to stop
+    it last gets the stats since it started, so each stretch of overlapping
+    checks is counted once, under the tool that finished last.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._profile = None
+        self._active = 0
+
+    def start(self):
+        import cProfile
+
+        with self._lock:
+            if not self._active:
+                self._profile = cProfile.Profile()
+                self._profile.enable()
+            self._active += 1
+
+    def stop(self):
+        """The stats since the profiler started if no other thread is in it, else None"""
+        with self._lock:
+            self._active -= 1
+            if self._active:
+                return None
+            self._profile.disable()
+            self._profile.create_stats()
+            return self._profile.stats
+
+
+class StatsSource:  # pylint: disable=too-few-public-methods
+    """Stand-in profiler that hands pstats.Stats stats gathered elsewhere"""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+def sampled_stats(samples):
+    """
+    pstats-style stats from StackSampler samples: a function's time is the
+    time it was seen running, and its cumulative time the time it was seen
+    anywhere on the stack; call counts are counts of stacks it was seen in
+    """
+    stats = {}
+    for stack, seconds in samples.items():
+        seen = set()
+        for depth, function in enumerate(stack):
+            entry = stats.setdefault(function, [0, 0, 0.0, 0.0, {}])
+            if depth == len(stack) - 1:
+                entry[2] += seconds
+            if function not in seen:
+                seen.add(function)
+                entry[0] += 1
+                entry[1] += 1
+                entry[3] += seconds
+            if depth:
+                caller = entry[4].setdefault(stack[depth - 1], [0, 0, 0.0, 0.0])
+                caller[0] += 1
+                caller[1] += 1
+                caller[2] += seconds if depth == len(stack) - 1 else 0.0
+                caller[3] += seconds
+    return {function: (cc, nc, tt, ct,
+        {caller: tuple(counts) for caller, counts in callers.items()})
+        for function, (cc, nc, tt, ct, callers) in stats.items()}
+
+
+def collapsed_stacks(tool, samples):
+    """Lines of samples in the collapsed-stack format flame graph tools read, in microseconds"""
+    lines = []
+    for stack, seconds in sorted(samples.items()):
+        frames = [tool] + [f"{name} ({os.path.basename(file_name)}:{line})"
+            for file_name, line, name in stack]
+        lines.append(f"{';'.join(frames)} {round(seconds * 1e6)}")
+    return lines
+
+
+def write_profile(prefix, profiler, tools, results):
+    """
+    Merge the tools' profiles into prefix.pstats, for pstats or snakeviz, and
+    with the sampler, their stacks into prefix.collapsed for flame graphs
+    """
+    import pstats
+
+    profiles = [(tool, result["profile"]) for tool, result in zip(tools, results)
+        if "profile" in result]
+    if not profiles:
+        return []
+    written = []
+    if profiler == "sample":
+        written.append(f"{prefix}.collapsed")
+        with open(written[0], "w", encoding="utf-8") as collapsed_file:
+            for tool, samples in profiles:
+                for line in collapsed_stacks(tool, samples):
+                    collapsed_file.write(line + "\n")
+        profiles = [(tool, sampled_stats(samples)) for tool, samples in profiles]
+    # pstats refuses empty stats, which a tool done within one sample has
+    profiles = [(tool, stats) for tool, stats in profiles if stats]
+    if profiles:
+        merged = pstats.Stats(StatsSource(profiles[0][1]))
+        for _, stats in profiles[1:]:
+            merged.add(StatsSource(stats))
+        merged.dump_stats(f"{prefix}.pstats")
+        written.insert(0, f"{prefix}.pstats")
+    return written
+
 
 class VersionCheck:
-    def __init__(self, debug):
+    def __init__(self, debug, cache_dir=None, github=None):
         self.versions = {
             "7Zip":            "23.01",
             "AndroidNDK":      "r26d",
@@ -56,466 +1439,1222 @@ class VersionCheck:
         }
 
         self.debug = debug
+        self.selected_tools = list(self.versions)
+        self.github = github or GitHubBackend()
+        # Base URL of a server replaying recorded pages, used for benchmarks
+        self.replay_url = None
+        self.timeout = DEFAULT_TIMEOUT
+        self.retries = DEFAULT_RETRIES
+        self.hedge = False
+        # time.monotonic() by which the whole run must be over
+        self.run_deadline = None
+        self.run_start = time.monotonic()
+        self.cache = DiskCache(cache_dir) if cache_dir else None
+        self.page_store = SingleFlight()
+        # Cap on requests in flight to each host; None is the cap for the rest
+        self.host_limits = {None: DEFAULT_HOST_LIMIT}
+        # "cprofile" or "sample" to profile each tool's check
+        self.profiler = None
+        # Skip tools that keep failing until their next probe; needs the cache
+        self.breaker = True
+        self._init_local_state()
+
+
+    def _init_local_state(self):
+        # Open page streams and connections can't leave this process, so they
+        # are rebuilt in every Pool worker instead of being pickled, and each
+        # worker keeps its own connections and host limits.
+        self._streams = SingleFlight()
+        self._open_streams = []
+        self.client = HTTPClient(self.host_limits)
+        self._sampler = StackSampler()
+        self._shared_profile = SharedProfile()
+
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_streams"]
+        del state["_open_streams"]
+        del state["client"]
+        del state["_sampler"]
+        del state["_shared_profile"]
+        return state
+
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_local_state()
+
+
+    @staticmethod
+    def page_key(url, headers=None, cookies=False):
+        return (url, tuple(sorted((headers or {}).items())), cookies)
+
+
+    @staticmethod
+    def validator(entry):
+        return entry["etag"] or entry["last_modified"]
+
+
+    def urls(self):
+        """Every URL the version check can read, with the headers it sends"""
+        urls = {}
+        for extractor in EXTRACTORS.values():
+            if isinstance(extractor, GitHubRelease):
+                urls[self.github.feed_url(extractor.repo)] = {}
+                continue
+            while extractor:
+                urls[extractor.url] = extractor.headers
+                extractor = extractor.fallback
+        return urls
+
+
+    def replay(self, req):
+        """Point a request at the replay server, as <replay_url>/<host>/<path>"""
+        if self.replay_url:
+            url = urlsplit(req.full_url)
+            path = url.path + (f"?{url.query}" if url.query else "")
+            req.full_url = f"{self.replay_url.rstrip('/')}/{url.hostname}{path}"
+        return req
+
+
+    def remaining(self):
+        """Seconds left before the current tool's deadline"""
+        deadline = current_deadline.get()
+        if deadline is None:
+            return self.timeout
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError("The deadline passed")
+        return remaining
+
+
+    def _open_hedged(self, opener, req, latency):
+        # pylint: disable=consider-using-with
+        hedge_after = latency * HEDGE_FACTOR if self.hedge and latency else None
+        if hedge_after is None or hedge_after >= self.remaining():
+            return opener(req, timeout=self.remaining())
+
+        from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+        # Both attempts run in worker threads that keep this tool's timings
+        executor = ThreadPoolExecutor(max_workers=2)
+        attempts = [executor.submit(contextvars.copy_context().run,
+            opener, req, timeout=self.remaining())]
+        try:
+            done, _ = wait(attempts, timeout=hedge_after)
+            if not done:
+                attempts.append(executor.submit(contextvars.copy_context().run,
+                    opener, req, timeout=self.remaining()))
+            pending = attempts
+            while pending:
+                done, pending = wait(pending, timeout=self.remaining(),
+                    return_when=FIRST_COMPLETED)
+                if not done:
+                    raise TimeoutError("No attempt answered before the deadline")
+                winner = done.pop()
+                if winner.exception() is None or not pending:
+                    break
+            for attempt in attempts:
+                if attempt is not winner:
+                    attempt.add_done_callback(
+                        lambda loser: loser.exception() or loser.result().close())
+            return winner.result()
+        finally:
+            executor.shutdown(wait=False)
+
+
+    def open_request(self, req, cookies=False, latency=None):
+        """
+        Open req within the current tool's deadline, retrying transient
+        failures with exponential backoff. With hedging on and a usual latency
+        known, a second request races the first once it's running late.
+        """
+        opener = functools.partial(self.client.open, cookies=cookies)
+        for attempt in range(self.retries + 1):
+            try:
+                return self._open_hedged(opener, req, latency)
+            except HTTPError as error:
+                # Hand the connection back; the status and headers are all that's used
+                error.close()
+                if error.code not in RETRY_STATUSES or attempt == self.retries:
+                    raise
+                last_error = error
+            except (URLError, OSError) as error:
+                if attempt == self.retries:
+                    raise
+                last_error = error
+            delay = RETRY_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5)
+            if delay >= self.remaining():
+                # No time for another try, so the last failure is the answer
+                raise last_error
+            with timed("retry_wait"):
+                time.sleep(delay)
+        raise AssertionError("unreachable")
+
+
+    def _open_page(self, key, conditional=True):
+        url, headers, cookies = key
+        entry = self.cache.load_page(key) if self.cache else None
+        cached = entry if conditional else None
+        headers = dict(headers)
+        headers.setdefault("Accept-Encoding", accept_encoding())
+        if cached and cached["etag"]:
+            headers["If-None-Match"] = cached["etag"]
+        if cached and cached["last_modified"]:
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+        # Usual time to the response headers, smoothed over past runs
+        usual_latency = entry.get("latency") if entry else None
+        start_time = time.perf_counter()
+        try:
+            response = self.open_request(self.replay(Request(url, headers=headers)),
+                cookies, usual_latency)
+        except HTTPError as error:
+            if error.code != 304 or not cached:
+                raise
+            self.cache.store_latency(key, smooth(usual_latency, time.perf_counter() - start_time))
+            return PageStream(body=cached["body"], validator=self.validator(cached),
+                not_modified=True, charset=cached["charset"])
+        latency = smooth(usual_latency, time.perf_counter() - start_time)
+
+        charset = response.headers.get_content_charset()
+        if not self.cache:
+            return PageStream(response, charset=charset)
+        entry = self.cache.store_page(key, response.headers, charset, latency)
+        return PageStream(response, validator=self.validator(entry), charset=charset,
+            on_complete=lambda body: self.cache.store_body(key, body))
+
+
+    def _share_page(self, key):
+        # In a Pool the download is shared between processes, which means
+        # reading the whole body; in-process readers share a lazy stream.
+        if not isinstance(self.page_store, SingleFlight):
+            def download():
+                stream = self._open_page(key)
+                body = stream.read() if stream.has_body else None
+                return Page(body, stream.validator, stream.not_modified, stream.charset)
+
+            def reopen():
+                page = single_flight(self.page_store, key, download)
+                return PageStream(body=page.body, validator=page.validator,
+                    not_modified=page.not_modified, charset=page.charset)
+
+            return single_flight(self._streams, key, reopen)
+
+        def open_stream():
+            stream = self._open_page(key)
+            self.track_stream(stream)
+            return stream
+
+        return single_flight(self._streams, key, open_stream)
+
+
+    def open_page(self, url, headers=None, cookies=False):
+        key = self.page_key(url, headers, cookies)
+        page = self._share_page(key)
+        pages = current_pages.get()
+        if pages is not None:
+            pages.append([self.cache.page_id(key) if self.cache else None, page.validator])
+
+        # Reuse the version found last time if it came from this same page and
+        # the server says the page hasn't changed since
+        tool = current_tool.get()
+        if page.not_modified and tool:
+            result = self.cache.load_result(tool)
+            if result and result["pages"] == pages:
+                raise CachedVersion(result["version"])
+
+        if not page.has_body:
+            # The last run stopped reading early and kept no body to reuse
+            unconditional_key = key + ("unconditional",)
+            page = single_flight(self._streams, unconditional_key,
+                lambda: self._open_page(key, conditional=False))
+            self.track_stream(page)
+        return page
+
+
+    def github_release_tags(self, release):
+        """Yield the release tags of a GitHubRelease's repo, newest first"""
+        if self.github.token:
+            repos = sorted({EXTRACTORS[tool].repo for tool in self.selected_tools
+                if isinstance(EXTRACTORS.get(tool), GitHubRelease)} | {release.repo})
+
+            def query():
+                request = self.replay(self.github.graphql_request(repos))
+                with self.open_request(request) as response:
+                    return self.github.graphql_tags(json.load(response), repos)
+
+            # One query answers every GitHub tool in the run
+            tags = single_flight(self.page_store, ("github-graphql", tuple(repos)), query)
+            if release.repo not in tags:
+                raise AttributeError(f"GitHub has no releases for {release.repo}")
+            yield from tags[release.repo]
+            return
+
+        page = self.open_page(self.github.feed_url(release.repo))
+        for link in iter_elements(page, release.feed_strainer):
+            yield unquote(release.tag_link.search(link.attrs["href"]).group(1))
+
+
+    def track_stream(self, stream):
+        """Close stream when the fetch group, or failing that the run, is over"""
+        self._open_streams.append(stream)
+        group_streams = current_streams.get()
+        if group_streams is not None:
+            group_streams.append(stream)
+
+
+    def close_pages(self):
+        for stream in self._open_streams:
+            stream.close()
+        self._open_streams = []
+
+
+    def get_latest_version(self, tool):
+        tool_token = current_tool.set(tool)
+        pages_token = current_pages.set([])
+        try:
+            try:
+                extractor = EXTRACTORS.get(tool)
+                if extractor is None:
+                    raise AttributeError(f"There is no extractor for {tool}")
+                latest_version = extractor.latest_version(self)
+            except CachedVersion as cached:
+                return cached.version
+            pages = current_pages.get()
+            if self.cache and pages and all(validator for _, validator in pages):
+                self.cache.store_result(tool, latest_version, pages)
+            return latest_version
+        finally:
+            current_pages.reset(pages_token)
+            current_tool.reset(tool_token)
 
 
     def compare_latest_to_current(self, tool):
+        health = self.cache.load_health(tool) if self.cache else None
+        if health and self.breaker and breaker_open(health, time.time()):
+            return skipped_result(self.versions.get(tool), health)
+
+        result = self.check(tool)
+        # Checks cut short by the run deadline say nothing about the website
+        if health is not None and not (result["status"] == "timeout"
+            and self.run_deadline is not None and time.monotonic() >= self.run_deadline):
+            self.cache.store_health(tool, record_health(health, result, time.time()))
+        return result
+
+
+    def check(self, tool):
         result = {}
         result["error"] = False
         result["uptodate"] = True
-
-        start_time = ""
+        result["status"] = "uptodate"
+        result["current"] = self.versions.get(tool)
+        result["latest"] = None
+
+        timings = {}
+        timings_token = current_timings.set(timings)
+        deadline = time.monotonic() + self.timeout
+        if self.run_deadline is not None:
+            deadline = min(deadline, self.run_deadline)
+        deadline_token = current_deadline.set(deadline)
+        start_time = time.perf_counter()
         try:
-            if self.debug:
-                start_time = time.time()
-            latest_version = getattr(self, f"get_latest_version_{tool}")()
-            if latest_version != self.versions[tool]:
-                print(f"{tool} {self.versions[tool]} can be upgraded to {latest_version}.")
+            with self.profiled(result):
+                result["latest"] = self.get_latest_version(tool)
+            if result["latest"] != self.versions[tool]:
+                result["status"] = "outdated"
                 result["uptodate"] = False
         except AttributeError as error:
-            print(f"{tool} version could not be found. Check the website.")
-            print(f"  Details: {error}")
+            result["status"] = "not-found"
+            result["details"] = str(error)
+            result["error"] = True
+        except (OSError, http.client.HTTPException) as error:
+            # urllib reports timeouts while connecting as a URLError
+            if isinstance(error, TimeoutError) or isinstance(
+                getattr(error, "reason", None), TimeoutError):
+                result["status"] = "timeout"
+            else:
+                result["status"] = "unreachable"
+            result["details"] = str(error)
             result["error"] = True
-        except (HTTPError, URLError) as error:
-            print(f"{tool} website could not be loaded.")
-            print(f"  Details: {error}")
+        except Exception as error:  # pylint: disable=broad-exception-caught
+            # A redesigned page can break an extractor in any number of ways;
+            # it's still just this tool's version that can't be found
+            result["status"] = "not-found"
+            result["details"] = f"{type(error).__name__}: {error}"
             result["error"] = True
         finally:
-            if self.debug:
-                elapsed_time = time.time() - start_time
-                print(f"{tool}: {elapsed_time} seconds")
+            current_deadline.reset(deadline_token)
+            timings["total"] = time.perf_counter() - start_time
+            result["timings"] = timings
+            current_timings.reset(timings_token)
         return result
 
 
-    def get_latest_version_7Zip(self):
-        with urlopen("https://www.7-zip.org/") as page:
-            soup = BeautifulSoup(page, "html.parser")
-
-        b_tag_contents = soup.findAll("b")
-        version_text_raw = None
-        for b_tag_content in b_tag_contents:
-            if "Download" in b_tag_content.text:
-                version_text_raw = b_tag_content.text
-                break
-
-        return version_text_raw.split()[2]
-
-
-    def get_latest_version_AndroidNDK(self):
-        with urlopen("https://developer.android.com/ndk/downloads/") as page:
-            soup = BeautifulSoup(page, "html.parser")
-
-        version_text = soup.find("h2", attrs={"id": "lts-downloads"}).text.split()[-1].strip("()")
-
-        return version_text
-
-
-    def get_latest_version_AndroidSDKAPI(self):
-        with urlopen(
-            "https://developer.android.com/guide/topics/manifest/uses-sdk-element") as page:
-            soup = BeautifulSoup(page, "html.parser")
-
-        version_text = soup.find("a",
-            attrs={"href": re.compile(r"^/sdk/api_diff/\d+/changes$")}).text
-
-        return version_text
-
-
-    def get_latest_version_AndroidStudio(self):
-        opener = build_opener(HTTPCookieProcessor())
-        install_opener(opener)
-        req = Request("https://developer.android.com/studio/releases",
-            headers={"User-Agent": "Mozilla/72 (X11; Linux i686)"})
-        with urlopen(req) as response:
-            page = response.read().decode('utf8', errors='ignore')
-            soup = BeautifulSoup(page, "html.parser")
-
-        version_items = soup.find("h1", attrs={"class": "devsite-page-title"}).text.split()
-
-        return version_items[-1]
-
-
-    def get_latest_version_box2d(self):
-        with urlopen("https://github.com/erincatto/box2d/releases") as page:
-            soup = BeautifulSoup(page, "html.parser")
-
-        version_text = soup.find("a",
-            attrs={"href": re.compile(
-                r"^/erincatto/box2d/releases/tag/v\d+\.\d+\.\d+$")}).text.strip().lstrip("v")
-
-        return version_text
-
-
-    def get_latest_version_bzip2(self):
-        with urlopen("https://sourceware.org/bzip2/") as page:
-            soup = BeautifulSoup(page, "html.parser")
-
-        version_text_raw = soup.find("td", attrs={"colspan": "2"}).text
-
-        for line in version_text_raw.splitlines():
-            if "The current stable version" in line:
-                version_text = line.split()[-1].strip(".")
-                break
-
-        return version_text
-
-
-    def get_latest_version_cmake(self):
-        opener = build_opener(HTTPCookieProcessor())
-        install_opener(opener)
-        req = Request("https://cmake.org/download/",
-            headers={"User-Agent": "Mozilla/72 (X11; Linux i686)"})
-        with urlopen(req) as response:
-            page = response.read().decode('utf8', errors='ignore')
-            soup = BeautifulSoup(page, "html.parser")
-
-        version_items = soup.find("h2", attrs={"id": "latest"}).text.strip().split()
-
-        version_text = version_items[2].strip("()")
-
-        return version_text
-
-
-    def get_latest_version_conan(self):
-        with urlopen("https://github.com/conan-io/conan/releases") as page:
-            soup = BeautifulSoup(page, "html.parser")
-
-        version_texts = soup.findAll("a",
-            attrs={"href":
-            re.compile(r"^/conan-io/conan/releases/tag")})
-        for version_text_raw in version_texts:
-            version_text = version_text_raw.text.strip().split()[0]
-            if version_text.split(".")[0] == "2":
-                break
-
-        return version_text
-
-
-    def get_latest_version_freetype(self):
-        with urlopen("https://sourceforge.net/projects/freetype/files/freetype2/") as page:
-            soup = BeautifulSoup(page, "html.parser")
-
-        version_text = soup.find("a",
-            attrs={"href":
-            lambda L: L and L.startswith("/projects/freetype/files/freetype2/")}).text.strip()
-
-        return str(version_text)
-
-
-    def get_latest_version_GIMP(self):
-        with urlopen("https://www.gimp.org/") as page:
-            soup = BeautifulSoup(page, "html.parser")
-
-        version_text = soup.find("span", attrs={"id": "ver"}).text
-
-        return str(version_text)
-
-
-    def get_latest_version_git(self):
-        req = Request("https://git-scm.com/download", headers={"User-Agent": "Mozilla/72"})
-        with urlopen(req) as response:
-            page = response.read()
-            soup = BeautifulSoup(page, "html.parser")
-
-        version_text = soup.find("span", attrs={"class": "version"}).text.strip()
-
-        return version_text
-
-
-    def get_latest_version_glew(self):
-        with urlopen("https://github.com/nigels-com/glew/releases") as page:
-            soup = BeautifulSoup(page, "html.parser")
-
-        version_items = soup.find("a",
-            attrs={"href":
-            re.compile(r"^/nigels-com/glew/releases/tag/glew-\d+\.\d+\.\d+$")}).text.split()
-
-        return version_items[1]
-
-
-    def get_latest_version_googletest(self):
-        with urlopen("https://github.com/google/googletest/releases") as page:
-            soup = BeautifulSoup(page, "html.parser")
-
-        version_text = soup.find("a",
-            attrs={"href":
-            re.compile(
-                r"^/google/googletest/releases/tag/v\d+\.\d+\.\d+$")}
-            ).text.strip().lstrip("v")
-
-        return version_text
-
-
-    def get_latest_version_Gradle(self):
-        with urlopen("https://gradle.org/install/") as page:
-            soup = BeautifulSoup(page, "html.parser")
-
-        version_items = soup.find("p").text.strip().split()
-
-        version_text = ""
-        for word in version_items:
-            result = re.match(r"^(\d+\.){1,2}(\d+)", word)
-            if result:
-                version_text = result.group()
-                break
-
-        return version_text
-
-
-    def get_latest_version_grepWin(self):
-        with urlopen("https://github.com/stefankueng/grepWin/releases/") as page:
-            soup = BeautifulSoup(page, "html.parser")
-
-        version_items = soup.find("a",
-            attrs={"href": re.compile(
-                r"^/stefankueng/grepWin/releases/tag/\d+\.\d+\.\d+$")}).text.split()
-
-        return version_items[1]
-
-
-    def get_latest_version_KeePassXC(self):
-        with urlopen("https://github.com/keepassxreboot/keepassxc/releases") as page:
-            soup = BeautifulSoup(page, "html.parser")
-
-        version_text = soup.find("a",
-            attrs={"href": re.compile(
-                r"^/keepassxreboot/keepassxc/releases/tag/\d+\.\d+\.\d+$")}
-                ).text.strip().lstrip("Release ")
-
-        return version_text
-
-
-    def get_latest_version_libpng(self):
-        with urlopen("http://www.libpng.org/pub/png/libpng.html") as page:
-            soup = BeautifulSoup(page, "html.parser")
-
-        version_text = soup.find("font", attrs={"size": "+1"}).text.strip()
-
-        return version_text
-
-
-    def get_latest_version_OBS(self):
-        with urlopen("https://obsproject.com/download") as page:
-            soup = BeautifulSoup(page, "html.parser")
-
-        version_items = soup.find("span",
-            attrs={"class": "dl_ver"}).text.replace(" ", "").split(":")
-
-        return version_items[1]
-
-
-    def get_latest_version_ogg(self):
-        with urlopen("https://xiph.org/downloads/") as page:
-            soup = BeautifulSoup(page, "html.parser")
-
-        version_text_raw = soup.find("a",
-            attrs={"href": re.compile(
-                r"^https://downloads.xiph.org/releases/ogg/libogg-\d+\.\d+\.\d+\.tar.gz$")}).text
-
-        version_text = ""
-        result = re.match(r"^libogg-(\d+\.\d+\.\d+)\.tar\.gz$", version_text_raw)
-        if result:
-            version_text = result.group(1)
-
-        return version_text
-
-
-    def get_latest_version_MuseScore(self):
-        with urlopen("https://github.com/musescore/MuseScore/releases") as page:
-            soup = BeautifulSoup(page, "html.parser")
-
-        version_text = soup.find("a",
-            attrs={"href": re.compile(
-                r"^/musescore/MuseScore/tree/v\d+\.\d+\.\d+$")}).text.strip().lstrip("v")
-
-        return version_text
-
-
-    def get_latest_version_ninja(self):
-        with urlopen("https://github.com/ninja-build/ninja/releases/latest") as page:
-            soup = BeautifulSoup(page, "html.parser")
-
-        version_text = soup.find("a",
-            attrs={"href": re.compile(
-                r"^/ninja-build/ninja/releases/tag/v\d+\.\d+\.\d+$")}).text.strip().lstrip("v")
-
-        return version_text
-
-
-    def get_latest_version_NotepadPlusPlus(self):
-        with urlopen("https://github.com/notepad-plus-plus/notepad-plus-plus/releases") as page:
-            soup = BeautifulSoup(page, "html.parser")
-
-        version_items = soup.find("a",
-            attrs={"href": re.compile(
-                r"^/notepad-plus-plus/notepad-plus-plus/releases/tag/v\d+\.\d+\.\d+$"
-                )}).text.split()
-
-        return version_items[-1]
-
-
-    def get_latest_version_python(self):
-        with urlopen("https://www.python.org/") as page:
-            soup = BeautifulSoup(page, "html.parser")
-
-        version_items = soup.find("a",
-            attrs={"href":
-            lambda L: L and L.startswith("/downloads/release/python-")}).text.strip().split()
-
-        return version_items[1]
-
-
-    def get_latest_version_SDL(self):
-        with urlopen("https://github.com/libsdl-org/SDL/releases") as page:
-            soup = BeautifulSoup(page, "html.parser")
-
-        version_text = soup.find("a",
-            attrs={"href":
-            re.compile(r"^/libsdl-org/SDL/releases/tag/release-\d+\.\d+\.\d+$")}).text.strip()
-
-        return version_text
-
-
-    def get_latest_version_SDL_image(self):
-        with urlopen("https://github.com/libsdl-org/SDL_image/releases") as page:
-            soup = BeautifulSoup(page, "html.parser")
-
-        version_text = soup.find("a",
-            attrs={"href": re.compile(
-                r"^/libsdl-org/SDL_image/releases/tag/release-\d+\.\d+\.\d+$")}).text.strip()
-
-        return version_text
-
+    @contextlib.contextmanager
+    def profiled(self, result):
+        """
+        Profile the block in this thread with self.profiler, if any, keeping
+        the cProfile stats or the stack samples in result["profile"]
+        """
+        if self.profiler == "cprofile" and sys.version_info >= (3, 12):
+            self._shared_profile.start()
+            try:
+                yield
+            finally:
+                stats = self._shared_profile.stop()
+                if stats is not None:
+                    result["profile"] = stats
+        elif self.profiler == "cprofile":
+            import cProfile
+
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                yield
+            finally:
+                profile.disable()
+                profile.create_stats()
+                result["profile"] = profile.stats
+        elif self.profiler == "sample":
+            self._sampler.start(VersionCheck.get_latest_version)
+            try:
+                yield
+            finally:
+                result["profile"] = self._sampler.stop()
+        else:
+            yield
+
+
+    def timed_out(self, tool):
+        """Result for a tool the engine gave up waiting for at the run deadline"""
+        return {
+            "error": True,
+            "uptodate": True,
+            "status": "timeout",
+            "current": self.versions.get(tool),
+            "latest": None,
+            "details": "The run deadline passed before the check finished",
+            "timings": {"total": time.monotonic() - self.run_start},
+        }
 
-    def get_latest_version_SDL_mixer(self):
-        with urlopen("https://github.com/libsdl-org/SDL_mixer/releases") as page:
-            soup = BeautifulSoup(page, "html.parser")
 
-        version_text = soup.find("a",
-            attrs={"href": re.compile(
-                r"^/libsdl-org/SDL_mixer/releases/tag/release-\d+\.\d+\.\d+$")}).text
+    def plan(self, tools):
+        """
+        Group tools by host, and within a host by the fetch they share, so each
+        group can be run off a single download
+        """
+        hosts = {}
+        for tool in tools:
+            extractor = EXTRACTORS.get(tool)
+            if extractor is None:
+                host, key = None, ("unknown", tool)
+            else:
+                host, key = extractor.host(self.github), extractor.fetch_key(self.github)
+            hosts.setdefault(host, {}).setdefault(key, []).append(tool)
+        return [group for fetches in hosts.values() for group in fetches.values()]
+
+
+    def compare_group(self, tools):
+        # Tools that read the same page are always planned into one group, so
+        # its streams can hang up, and free their connections, once it's done
+        streams_token = current_streams.set([])
+        try:
+            return [(tool, self.compare_latest_to_current(tool)) for tool in tools]
+        finally:
+            for stream in current_streams.get():
+                stream.close()
+            current_streams.reset(streams_token)
+
+
+    def compare_as_completed_pool(self, groups, jobs):
+        # Workers share downloads through a page store served by a manager
+        # process; each worker still parses the pages it needs itself.
+        from multiprocessing import TimeoutError as PoolTimeoutError
+
+        context = pool_context()
+        local_store = self.page_store
+        with page_store_manager(context) as manager:  # pylint: disable=contextmanager-generator-missing-cleanup
+            self.page_store = manager.SingleFlight()  # pylint: disable=no-member
+            try:
+                # Leaving the with block terminates any worker still stuck
+                with context.Pool(processes=min(jobs, len(groups))) as pool:
+                    waiting = [tool for group in groups for tool in group]
+                    group_results = pool.imap_unordered(self.compare_group, groups)
+                    try:
+                        for _ in groups:
+                            for tool, result in group_results.next(self.time_to_deadline()):
+                                waiting.remove(tool)
+                                yield tool, result
+                    except PoolTimeoutError:
+                        for tool in waiting:
+                            yield tool, self.timed_out(tool)
+            finally:
+                self.page_store = local_store
+
+
+    def compare_as_completed_threads(self, groups, jobs):
+        # The extractors do blocking I/O, so they run on a bounded set of
+        # threads in this process instead of forked workers, and each group
+        # is yielded as soon as its thread finishes it.
+        from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+        executor = ThreadPoolExecutor(max_workers=min(jobs, len(groups)))
+        try:
+            futures = {executor.submit(self.compare_group, group): group for group in groups}
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, timeout=self.time_to_deadline(),
+                    return_when=FIRST_COMPLETED)
+                if not done:
+                    break
+                for future in done:
+                    yield from future.result()
+            for future in pending:
+                future.cancel()
+                for tool in futures[future]:
+                    yield tool, self.timed_out(tool)
+        finally:
+            # Don't wait for stuck threads; their sockets time out on their own
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+    def time_to_deadline(self):
+        """Seconds the engines wait for results, or None without a run deadline"""
+        if self.run_deadline is None:
+            return None
+        return max(self.run_deadline + DEADLINE_GRACE - time.monotonic(), 0)
+
+
+    def compare_as_completed(self, tools, engine="threads", jobs=DEFAULT_JOBS, deadline=None):
+        """Yield (tool, result) for each of tools as soon as its check finishes"""
+        tools = list(tools)
+        self.selected_tools = tools
+        # Pages are shared between the tools of a run, never between runs
+        self.page_store = SingleFlight()
+        self._streams = SingleFlight()
+        self.run_start = time.monotonic()
+        self.run_deadline = self.run_start + deadline if deadline else None
+        groups = self.plan(tools)
+        if self.cache:
+            # Tools that have been failing go last, so they don't hold up the rest
+            failures = {tool: self.cache.load_health(tool).get("failures", 0) for tool in tools}
+            groups.sort(key=lambda group: max(failures[tool] for tool in group))
+        try:
+            if engine == "pool":
+                yield from self.compare_as_completed_pool(groups, jobs)
+            else:
+                yield from self.compare_as_completed_threads(groups, jobs)
+        finally:
+            self.close_pages()
+
+
+    def compare_all(self, tools, engine="threads", jobs=DEFAULT_JOBS, deadline=None):
+        tools = list(tools)
+        results = dict(self.compare_as_completed(tools, engine, jobs, deadline))
+        return [results[tool] for tool in tools]
+
+
+
+def poll_interval(entry, changed, failed):
+    """
+    Seconds until --watch checks a tool again: soon after a new release or a
+    failure, then backing off while nothing changes, but never slower than a
+    fraction of the usual time between the releases it has seen
+    """
+    if changed or failed:
+        return MIN_POLL_INTERVAL
+    interval = min(entry.get("interval", MIN_POLL_INTERVAL) * 2, MAX_POLL_INTERVAL)
+    changes = entry.get("changes", [])
+    if len(changes) >= 3:
+        import statistics
+        usual_gap = statistics.median(later - earlier
+            for earlier, later in zip(changes, changes[1:]))
+        interval = min(interval, max(usual_gap / POLLS_PER_RELEASE, MIN_POLL_INTERVAL))
+    return interval
+
+
+def record_health(health, result, now):
+    """
+    A tool's health record updated with the result of a check finished at
+    now; after BREAKER_THRESHOLD failures in a row its breaker opens until
+    retry_at, with the wait doubling each time the probe fails too. Failures
+    of another version of the script don't count, as its extractors may
+    have been fixed since.
+    """
+    health = dict(health)
+    if health.get("script") != script_fingerprint():
+        for key in ("failures", "backoff", "retry_at"):
+            health.pop(key, None)
+    health["script"] = script_fingerprint()
+    failed = result["status"] not in ("uptodate", "outdated")
+    checks = health.get("checks", []) + [{
+        "at": now,
+        "ok": not failed,
+        "elapsed": round(result["timings"].get("total", 0.0), 6),
+    }]
+    health["checks"] = checks[-HEALTH_HISTORY:]
+    if not failed:
+        health["last_success"] = {"at": now, "latest": result["latest"]}
+        for key in ("failures", "backoff", "retry_at"):
+            health.pop(key, None)
+        return health
+    health["last_error"] = {"at": now, "status": result["status"],
+        "details": result.get("details")}
+    health["failures"] = health.get("failures", 0) + 1
+    if health["failures"] >= BREAKER_THRESHOLD:
+        backoff = health.get("backoff")
+        health["backoff"] = min(backoff * 2, MAX_BREAKER_BACKOFF) if backoff else BREAKER_BACKOFF
+        health["retry_at"] = now + health["backoff"]
+    return health
+
+
+def breaker_open(health, now):
+    """Whether a tool has failed too often lately to be checked again before its probe"""
+    return (health.get("script") == script_fingerprint()
+        and health.get("failures", 0) >= BREAKER_THRESHOLD and now < health.get("retry_at", 0))
+
+
+def skipped_result(current, health):
+    """Result for a tool skipped by its breaker, carrying its last known latest version"""
+    last_error = health.get("last_error", {})
+    last_success = health.get("last_success", {})
+    details = ""
+    if last_success:
+        details += (f"Last known latest version: {last_success['latest']} (stale), "
+            f"found at {format_time(last_success['at'])}. ")
+    details += (f"{health['failures']} checks in a row failed, the last one with "
+        f"{last_error.get('status')}: {last_error.get('details')}. ")
+    details += f"It will be checked again after {format_time(health['retry_at'])}."
+    return {
+        "error": True,
+        "uptodate": True,
+        "status": "skipped",
+        "current": current,
+        "latest": last_success.get("latest"),
+        "details": details,
+        "timings": {"total": 0.0},
+    }
+
+
+def format_time(timestamp):
+    return time.strftime("%Y-%m-%d %H:%M:%S UTC", time.gmtime(timestamp))
+
+
+def health_report(version_check, tools):
+    """Lines with the success rate, latencies and last error of each tool's checks"""
+    import statistics
+
+    lines = []
+    now = time.time()
+    for tool in tools:
+        health = version_check.cache.load_health(tool)
+        checks = health.get("checks", [])
+        if not checks:
+            lines.append(f"{tool}: no checks recorded")
+            continue
+        ok = sum(check["ok"] for check in checks)
+        line = f"{tool}: {ok}/{len(checks)} recent checks succeeded"
+        latencies = sorted(check["elapsed"] for check in checks if check["ok"])
+        if len(latencies) >= 2:
+            deciles = statistics.quantiles(latencies, n=10, method="inclusive")
+            line += f", p50 {statistics.median(latencies):.3f}s, p90 {deciles[8]:.3f}s"
+        elif latencies:
+            line += f", p50 {latencies[0]:.3f}s"
+        lines.append(line)
+        if "last_error" in health:
+            last_error = health["last_error"]
+            lines.append(f"  Last error at {format_time(last_error['at'])}: "
+                f"{last_error['status']}: {last_error['details']}")
+        if breaker_open(health, now):
+            lines.append(f"  Skipped until {format_time(health['retry_at'])}")
+    return lines
+
+
+class StatusBoard:
+    """
+    Latest known result of every tool for --watch, kept in a status file so
+    it survives restarts and can be read without checking anything
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.tools = {}
+        try:
+            with open(path, "r", encoding="utf-8") as status_file:
+                self.tools = json.load(status_file)["tools"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def due(self, tools, now):
+        with self.lock:
+            return [tool for tool in tools
+                if self.tools.get(tool, {}).get("next_check", 0) <= now]
+
+    def next_check(self, tools):
+        with self.lock:
+            return min(self.tools.get(tool, {}).get("next_check", 0) for tool in tools)
+
+    def update(self, tool, result, now):
+        """Record a result and schedule the next check; return whether anything changed"""
+        with self.lock:
+            entry = self.tools.setdefault(tool, {})
+            failed = result["error"]
+            changed = not failed and entry.get("latest") not in (None, result["latest"])
+            if changed:
+                entry["changes"] = entry.get("changes", []) + [now]
+            reported = (entry.get("status"), entry.get("latest"))
+            # A failed check keeps the last version found, so the next one
+            # that succeeds can tell whether it changed
+            last_known = entry.get("latest")
+            entry.update(result_record(tool, result))
+            if failed and last_known is not None:
+                entry["latest"] = last_known
+            entry["checked_at"] = now
+            entry["interval"] = poll_interval(entry, changed, failed)
+            entry["next_check"] = now + entry["interval"]
+            return reported != (entry["status"], entry["latest"])
+
+    def snapshot(self):
+        with self.lock:
+            return {"updated_at": time.time(), "tools": json.loads(json.dumps(self.tools))}
+
+    def save(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        with os.fdopen(fd, "w", encoding="utf-8") as temp_file:
+            json.dump(self.snapshot(), temp_file, indent=2)
+        os.replace(temp_path, self.path)
+
+
+def serve_status(board, port):
+    """
+    Serve board as JSON at http://127.0.0.1:port/status, and one tool at
+    /status/<tool>, from a background thread
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class StatusHandler(BaseHTTPRequestHandler):
+
+        def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+            pass
+
+        def do_GET(self):
+            snapshot = board.snapshot()
+            parts = [part for part in urlsplit(self.path).path.split("/") if part]
+            if parts == ["status"]:
+                body = snapshot
+            elif len(parts) == 2 and parts[0] == "status" and parts[1] in snapshot["tools"]:
+                body = snapshot["tools"][parts[1]]
+            else:
+                self.send_error(404)
+                return
+            data = json.dumps(body, indent=2).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), StatusHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def watch(version_check, args, log):
+    """
+    Check each tool whenever it's due, forever, keeping the status file and
+    the optional HTTP endpoint up to date, with messages other than results
+    going to log
+    """
+    board = StatusBoard(args.status_file)
+    if args.status_port is not None:
+        server = serve_status(board, args.status_port)
+        print(f"Serving the status at http://127.0.0.1:{server.server_port}/status",
+            file=log, flush=True)
+
+    tools = [args.tool] if args.tool else list(version_check.versions)
+    while True:
+        due = board.due(tools, time.time())
+        if due:
+            for tool, result in version_check.compare_as_completed(due, args.engine, args.jobs,
+                args.deadline):
+                if board.update(tool, result, time.time()):
+                    report_result(tool, result, args.output, args.debug)
+            board.save()
+        time.sleep(min(max(board.next_check(tools) - time.time(), 0), WATCH_TICK))
+
+
+def read_status(version_check, source, tools, max_age=None):
+    """
+    Results of tools from a status file or URL written by --watch, compared
+    against the versions in this script; tools missing from it or checked
+    longer than max_age seconds ago are reported as stale
+    """
+    if urlsplit(source).scheme in ("http", "https"):
+        with urlopen(source, timeout=DEFAULT_TIMEOUT) as response:
+            snapshot = json.load(response)
+    else:
+        with open(source, "r", encoding="utf-8") as status_file:
+            snapshot = json.load(status_file)
+
+    completed = []
+    for tool in tools:
+        entry = snapshot["tools"].get(tool, {})
+        if max_age is not None and time.time() - entry.get("checked_at", 0) > max_age:
+            entry = dict(entry, status="stale")
+        completed.append((tool, stored_result(version_check, tool, entry, "stale")))
+    return completed
+
+
+def stored_result(version_check, tool, entry, missing):
+    """
+    A tool's result rebuilt from a record an earlier check wrote, compared
+    against the versions in this script; an empty entry gets status missing
+    """
+    result = {
+        "current": version_check.versions.get(tool),
+        "latest": entry.get("latest"),
+        "status": entry.get("status", missing),
+        "timings": {"total": entry.get("elapsed", 0.0)},
+    }
+    if "details" in entry:
+        result["details"] = entry["details"]
+    if result["status"] in ("uptodate", "outdated"):
+        result["status"] = "uptodate" if result["latest"] == result["current"] else "outdated"
+    result["error"] = result["status"] not in ("uptodate", "outdated")
+    result["uptodate"] = result["status"] != "outdated"
+    return result
+
+
+def read_records(paths):
+    """The last record for each tool in files written with --output json-lines"""
+    records = {}
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as records_file:
+            for line in records_file:
+                if line.strip():
+                    record = json.loads(line)
+                    records[record["tool"]] = record
+    return records
+
+
+def shard_groups(groups, weights, count):
+    """
+    Split fetch groups into count shards expected to take about as long as
+    each other, given seconds each tool took before
+
+    Heaviest groups go first, each onto the shard with the least work so far.
+    A group takes as long as its slowest tool, since its tools share their
+    fetch, and a tool with no history counts as a typical one. Ties are
+    broken by name and shard number, so every shard computes the same split.
+    """
+    import statistics
+
+    default = statistics.median(weights.values()) if weights else 1.0
+
+    def cost(group):
+        return max(weights.get(tool, default) for tool in group)
+
+    shards = [[] for _ in range(count)]
+    loads = [0.0] * count
+    for group in sorted(groups, key=lambda group: (-cost(group), sorted(group))):
+        lightest = min(range(count), key=lambda index: (loads[index], index))
+        shards[lightest].extend(group)
+        loads[lightest] += cost(group)
+    return shards
+
+
+def shard(text):
+    """A --shard of I/N as (I, N), with shards numbered from 1"""
+    index, _, count = text.partition("/")
+    if not (index.isdigit() and count.isdigit() and 1 <= int(index) <= int(count)):
+        raise argparse.ArgumentTypeError(f"expected I/N with 1 <= I <= N: {text}")
+    return int(index), int(count)
+
+
+def host_limit(text):
+    """A --host-limit of N for every host, or HOST=N for one, as (host, N)"""
+    host, _, limit = text.rpartition("=")
+    if not limit.isdigit() or int(limit) < 1:
+        raise argparse.ArgumentTypeError(f"expected N or HOST=N with N at least 1: {text}")
+    return host or None, int(limit)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
 
-        return version_text
+    parser.add_argument(
+        "--debug",
+        required=False,
+        help="Turn on debug info",
+        action="store_true"
+    )
 
+    parser.add_argument(
+        "--tool",
+        required=False,
+        help="Tool to version check",
+        type=str
+    )
 
-    def get_latest_version_SDL_ttf(self):
-        with urlopen("https://github.com/libsdl-org/SDL_ttf/releases") as page:
-            soup = BeautifulSoup(page, "html.parser")
+    parser.add_argument(
+        "--engine",
+        required=False,
+        help="How to run the version checks concurrently (default: %(default)s)",
+        choices=["threads", "pool"],
+        default="threads"
+    )
 
-        version_text = soup.find("a",
-            attrs={"href": re.compile(
-                r"^/libsdl-org/SDL_ttf/releases/tag/release-\d+\.\d+\.\d+$")}).text.strip()
+    parser.add_argument(
+        "--jobs",
+        required=False,
+        help="Maximum number of version checks to run at once (default: %(default)s)",
+        type=int,
+        default=DEFAULT_JOBS
+    )
 
-        return version_text
+    parser.add_argument(
+        "--output",
+        required=False,
+        help="text for people, or json-lines for one JSON record per tool as it finishes",
+        choices=["text", "json-lines"],
+        default="text"
+    )
 
+    parser.add_argument(
+        "--watch",
+        required=False,
+        help="Keep checking each tool on its own schedule, adapted to how often it releases, "
+            "and keep the results in --status-file",
+        action="store_true"
+    )
 
-    def get_latest_version_SFML(self):
-        with urlopen("https://www.sfml-dev.org/download.php") as page:
-            soup = BeautifulSoup(page, "html.parser")
+    parser.add_argument(
+        "--status-file",
+        required=False,
+        help="Status file --watch writes (default: status.json in the cache dir)",
+        type=str
+    )
 
-        version_items = soup.find("div", attrs={"class": "title"}).text.strip().split()
+    parser.add_argument(
+        "--status-port",
+        required=False,
+        help="With --watch, also serve the status at http://127.0.0.1:PORT/status",
+        type=int
+    )
 
-        return version_items[-1]
+    parser.add_argument(
+        "--read-status",
+        required=False,
+        help="Report the results in a status file or URL from --watch instead of checking",
+        type=str
+    )
 
+    parser.add_argument(
+        "--max-age",
+        required=False,
+        help="With --read-status, report tools checked longer ago than this many seconds "
+            "as stale",
+        type=float
+    )
 
-    def get_latest_version_vorbis(self):
-        with urlopen("https://xiph.org/downloads/") as page:
-            soup = BeautifulSoup(page, "html.parser")
+    parser.add_argument(
+        "--shard",
+        required=False,
+        help="Only check shard I of N, splitting the tools so shards take about as long "
+            "as each other; write each shard's --output json-lines to a file for --merge",
+        type=shard
+    )
 
-        td_tag_contents = soup.findAll("td")
-        version_text = None
-        vorbis_version_found = False
-        for td_tag_content in td_tag_contents:
-            if vorbis_version_found:
-                version_text = td_tag_content.text
-                break
-            if "libvorbis" in td_tag_content.text:
-                vorbis_version_found = True
+    parser.add_argument(
+        "--shard-weights",
+        required=False,
+        help="JSON-lines results of an earlier run, whose check times --shard balances by; "
+            "every shard must be given the same file",
+        type=str,
+        nargs="+",
+        default=[]
+    )
 
-        return version_text
+    parser.add_argument(
+        "--merge",
+        required=False,
+        help="Report the JSON-lines results of every --shard together, with the same "
+            "exit code as a full run, instead of checking",
+        type=str,
+        nargs="+"
+    )
 
+    parser.add_argument(
+        "--timeout",
+        required=False,
+        help="Seconds each tool gets before it's reported as timed out (default: %(default)s)",
+        type=float,
+        default=DEFAULT_TIMEOUT
+    )
 
-    def get_latest_version_VS2022(self):
-        with urlopen(
-            "https://docs.microsoft.com/en-us/visualstudio/releases/2022/release-notes") as page:
-            soup = BeautifulSoup(page, "html.parser")
+    parser.add_argument(
+        "--deadline",
+        required=False,
+        help="Seconds the whole run gets; tools still going then are reported as timed out",
+        type=float
+    )
 
-        version_text_raw = soup.find("a",
-            attrs={"href": re.compile(r"^#\d+\.\d+\.\d+$")})
-        if version_text_raw:
-            version_text = version_text_raw.text.strip().split()[4]
-        else:
-            version_text = soup.find("h2",
-            attrs={"id": re.compile(
-                r"^\d+--visual-studio-\d+-version-\d+$")}).text.strip().split()[-1]
+    parser.add_argument(
+        "--retries",
+        required=False,
+        help="Times to retry a failed request, with backoff (default: %(default)s)",
+        type=int,
+        default=DEFAULT_RETRIES
+    )
 
-        return version_text
+    parser.add_argument(
+        "--hedge",
+        required=False,
+        help="Send a second request when a page is much slower than it usually is",
+        action="store_true"
+    )
 
+    parser.add_argument(
+        "--host-limit",
+        required=False,
+        help="Requests in flight to any one host at once, or HOST=N to set it for one host; "
+            f"can be given more than once (default: {DEFAULT_HOST_LIMIT})",
+        type=host_limit,
+        action="append",
+        default=[]
+    )
 
-    def get_latest_version_Xcode(self):
-        req = Request("https://apps.apple.com/us/app/xcode/id497799835",
-            headers={"User-Agent": "Mozilla/72"})
-        with urlopen(req) as response:
-            page = response.read()
-            soup = BeautifulSoup(page, "html.parser")
-        version_items = soup.find("p",
-            attrs={"class": "l-column small-6 medium-12 whats-new__latest__version"}).text.split()
+    parser.add_argument(
+        "--cache-dir",
+        required=False,
+        help="Where to keep pages between runs for conditional requests (default: %(default)s)",
+        type=str,
+        default=DEFAULT_CACHE_DIR
+    )
 
-        return version_items[1]
+    parser.add_argument(
+        "--github-url",
+        required=False,
+        help="GitHub server to read release feeds from (default: %(default)s)",
+        type=str,
+        default="https://github.com"
+    )
 
+    parser.add_argument(
+        "--github-api-url",
+        required=False,
+        help="GitHub API server for batched release queries (default: %(default)s)",
+        type=str,
+        default="https://api.github.com"
+    )
 
-    def get_latest_version_zlib(self):
-        with urlopen("https://zlib.net/") as page:
-            soup = BeautifulSoup(page, "html.parser")
+    parser.add_argument(
+        "--timings-json",
+        required=False,
+        help="Write per-tool, per-phase timings to this JSON file",
+        type=str
+    )
 
-        version_items = soup.find("font", attrs={"size": "+2"}).text.strip().split()
+    parser.add_argument(
+        "--profile",
+        required=False,
+        help="Profile each tool's check, in the worker or thread running it, and write "
+            "the merged profile to PREFIX.pstats, and with the sampler PREFIX.collapsed too",
+        metavar="PREFIX",
+        type=str
+    )
 
-        return version_items[1]
+    parser.add_argument(
+        "--profiler",
+        required=False,
+        help="cprofile for exact call counts and times, or sample for low-overhead stack "
+            "samples that also make a collapsed-stack file for flame graphs "
+            "(default: %(default)s)",
+        choices=["cprofile", "sample"],
+        default="cprofile"
+    )
 
+    parser.add_argument(
+        "--replay-url",
+        required=False,
+        help="Fetch every page from this server of recorded pages instead of the web",
+        type=str
+    )
 
+    parser.add_argument(
+        "--list-urls",
+        required=False,
+        help="Print the URLs the check reads, with their request headers, as JSON",
+        action="store_true"
+    )
 
-def main():
-    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--no-cache",
+        required=False,
+        help="Download every page in full and don't touch the cache",
+        action="store_true"
+    )
 
     parser.add_argument(
-        "--debug",
+        "--no-breaker",
         required=False,
-        help="Turn on debug info",
+        help="Check tools that keep failing too, instead of reporting their last known "
+            "latest version until their next probe",
         action="store_true"
     )
 
     parser.add_argument(
-        "--tool",
+        "--health",
         required=False,
-        help="Tool to version check",
-        type=str
+        help="Print the success rate, latencies and last error of each tool's recent "
+            "checks, kept in the cache",
+        action="store_true"
     )
 
     args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.shard and (args.tool or args.watch):
+        parser.error("--shard can't be combined with --tool or --watch")
+    if args.profile and args.watch:
+        parser.error("--profile can't be combined with --watch, which never finishes")
+    if args.health and args.no_cache:
+        parser.error("--health reads the cache, so it can't be combined with --no-cache")
+    return args
+
+
+def report_result(tool, result, output, debug):
+    """Print a tool's result the moment it's in, in one write so lines don't interleave"""
+    if output == "json-lines":
+        print(json.dumps(result_record(tool, result)), flush=True)
+        return
+    lines = describe(tool, result)
+    if debug:
+        lines.append(f"{tool}: {result['timings'].get('total', 0.0)} seconds")
+    if lines:
+        print("\n".join(lines), flush=True)
+
+
+def start_checks(version_check, args, log):
+    """The tools to report on, and their (tool, result) pairs as they complete"""
+    if args.read_status:
+        tools = [args.tool] if args.tool else list(version_check.versions)
+        return tools, read_status(version_check, args.read_status, tools, args.max_age)
+    if args.merge:
+        tools = [args.tool] if args.tool else list(version_check.versions)
+        records = read_records(args.merge)
+        return tools, [(tool, stored_result(version_check, tool, records.get(tool, {}),
+            "missing")) for tool in tools]
+    if args.tool:
+        tools = [args.tool]
+        version_check.selected_tools = tools
+        return tools, [(args.tool, version_check.compare_latest_to_current(args.tool))]
+    tools = list(version_check.versions)
+    if args.shard:
+        index, count = args.shard
+        weights = {tool: record["elapsed"]
+            for tool, record in read_records(args.shard_weights).items()}
+        tools = shard_groups(version_check.plan(tools), weights, count)[index - 1]
+        if not tools:
+            return tools, []
+    if args.debug:
+        for group in version_check.plan(tools):
+            print(f"Fetch group: {', '.join(group)}", file=log)
+    return tools, version_check.compare_as_completed(tools, args.engine, args.jobs,
+        args.deadline)
+
+
+def write_reports(args, tools, results, wall_time, log):
+    """Write the --timings-json and --profile files asked for"""
+    if args.profile:
+        for path in write_profile(args.profile, args.profiler, tools, results):
+            print(f"Wrote the profile to {path}", file=log)
+
+    if args.timings_json:
+        with open(args.timings_json, "w", encoding="utf-8") as timings_file:
+            json.dump({
+                "engine": args.engine,
+                "jobs": args.jobs,
+                "wall_time": wall_time,
+                "tools": {tool: result["timings"] for tool, result in zip(tools, results)},
+            }, timings_file, indent=2)
 
-    version_check = VersionCheck(args.debug)
+
+def main():
+    args = parse_args()
+
+    # A token lets all GitHub tools share one GraphQL query instead of a feed each
+    github = GitHubBackend(args.github_url, args.github_api_url,
+        os.environ.get("GITHUB_TOKEN") or os.environ.get("GH_TOKEN"))
+    version_check = VersionCheck(args.debug, None if args.no_cache else args.cache_dir, github)
+    version_check.replay_url = args.replay_url
+    version_check.timeout = args.timeout
+    version_check.retries = args.retries
+    version_check.hedge = args.hedge
+    version_check.host_limits.update(args.host_limit)
+    # A tool asked for by name is checked even if its breaker is open
+    version_check.breaker = not (args.no_breaker or (args.tool and not args.watch))
+    if args.profile:
+        version_check.profiler = args.profiler
+
+    if args.list_urls:
+        print(json.dumps(version_check.urls(), indent=2))
+        sys.exit(0)
+
+    if args.health:
+        print("\n".join(health_report(version_check,
+            [args.tool] if args.tool else list(version_check.versions))))
+        sys.exit(0)
+
+    # Keep stdout to the records in json-lines mode
+    log = sys.stderr if args.output == "json-lines" else sys.stdout
+
+    if args.watch:
+        if not args.status_file:
+            args.status_file = os.path.join(args.cache_dir, "status.json")
+        try:
+            watch(version_check, args, log)
+        except KeyboardInterrupt:
+            sys.exit(0)
 
     error = []
     uptodate = []
 
-    if args.tool:
-        results = version_check.compare_latest_to_current(args.tool)
-        error.append(results["error"])
-        uptodate.append(results["uptodate"])
-    else:
-        with Pool(processes=len(version_check.versions)) as pool:
-            results = pool.map(version_check.compare_latest_to_current, version_check.versions)
-        for result in results:
-            error.append(result["error"])
-            uptodate.append(result["uptodate"])
+    start_time = time.perf_counter()
+    tools, completed = start_checks(version_check, args, log)
+
+    results = {}
+    for tool, result in completed:
+        results[tool] = result
+        report_result(tool, result, args.output, args.debug)
+    results = [results[tool] for tool in tools]
+    wall_time = time.perf_counter() - start_time
+
+    for result in results:
+        error.append(result["error"])
+        uptodate.append(result["uptodate"])
+
+    if args.debug:
+        print(f"Total: {wall_time} seconds", file=log)
+        print("\n".join(timing_report(tools, results)), file=log)
+
+    write_reports(args, tools, results, wall_time, log)
 
     if False in uptodate:
-        print("Do the upgrade(s) and update the latest version(s) at the top of this script.")
+        print("Do the upgrade(s) and update the latest version(s) at the top of this script.",
+            file=log)
         sys.exit(1)
     else:
         if True in error:
             sys.exit(1)
         else:
-            print("Everything is up-to-date!")
+            print("Everything is up-to-date!", file=log)
             sys.exit(0)
 
 
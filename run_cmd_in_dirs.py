@@ -3,8 +3,344 @@
 """Tool to run commands across multiple repos"""
 
 import argparse
+import ast
+import hashlib
+import json
 import os
 import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+# Where --incremental remembers the dirs each command last succeeded in
+DEFAULT_STATE_FILE = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "ssrobins-tools", "run-cmd-in-dirs.json")
+
+# Class attributes and methods of a Conan recipe that declare its requirements
+REQUIRES = frozenset(["requires", "tool_requires", "build_requires"])
+
+
+def class_name_attribute(tree):
+    """The name a recipe class sets as a plain string class attribute, or None"""
+    for class_node in tree.body:
+        if not isinstance(class_node, ast.ClassDef):
+            continue
+        for statement in class_node.body:
+            if (isinstance(statement, ast.Assign)
+                and any(isinstance(target, ast.Name) and target.id == "name"
+                    for target in statement.targets)
+                and isinstance(statement.value, ast.Constant)
+                and isinstance(statement.value.value, str)):
+                return statement.value.value
+    return None
+
+
+def read_recipe(conan_file_content):
+    """
+    The package name of a recipe, or None if it doesn't set one, and the
+    names of the packages it requires, from requires-style class attributes
+    holding a string, tuple or list, and from calls like
+    self.requires("zlib/1.3.1@ssrobins"); only the literal start of an
+    f-string needs to be known
+    """
+    try:
+        tree = ast.parse(conan_file_content)
+    except SyntaxError:
+        return None, []
+
+    def references(node):
+        if isinstance(node, (ast.Tuple, ast.List)):
+            return [reference for element in node.elts for reference in references(element)]
+        if isinstance(node, ast.JoinedStr) and node.values:
+            node = node.values[0]
+        if isinstance(node, ast.Constant) and isinstance(node.value, str):
+            return [node.value]
+        return []
+
+    found = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Assign):
+            if any(isinstance(target, ast.Name) and target.id in REQUIRES
+                for target in node.targets):
+                found += references(node.value)
+        elif isinstance(node, ast.AnnAssign):
+            if isinstance(node.target, ast.Name) and node.target.id in REQUIRES and node.value:
+                found += references(node.value)
+        elif isinstance(node, ast.Call) and node.args:
+            function = node.func
+            name = function.attr if isinstance(function, ast.Attribute) else getattr(
+                function, "id", None)
+            if name in REQUIRES:
+                found += references(node.args[0])
+    return class_name_attribute(tree), [reference.split("/")[0] for reference in found
+        if "/" in reference]
+
+
+def read_dependencies(repo_dirs):
+    """
+    Map each of repo_dirs to the ones among repo_dirs its conanfile.py
+    requires; dirs without a conanfile.py have no dependencies
+    """
+    recipes = {}
+    packages = {}
+    for repo_dir in repo_dirs:
+        try:
+            with open(os.path.join(os.getcwd(), repo_dir, "conanfile.py"),
+                "r", encoding="utf-8") as conan_file:
+                recipes[repo_dir] = read_recipe(conan_file.read())
+        except FileNotFoundError:
+            recipes[repo_dir] = (None, [])
+        packages[recipes[repo_dir][0] or os.path.basename(repo_dir)] = repo_dir
+
+    dependencies = {}
+    for repo_dir, (_, required_packages) in recipes.items():
+        required = [packages[package] for package in required_packages
+            if package in packages]
+        dependencies[repo_dir] = [dep for dep in dict.fromkeys(required) if dep != repo_dir]
+    return dependencies
+
+
+def schedule_order(repo_dirs, dependencies):
+    """
+    Order repo_dirs so every dir comes after its dependencies, putting the
+    dirs that hold up the most others first and keeping the given order
+    otherwise; raise ValueError on a dependency cycle
+    """
+    dependents = {repo_dir: [] for repo_dir in repo_dirs}
+    for repo_dir in repo_dirs:
+        for dep in dependencies[repo_dir]:
+            dependents[dep].append(repo_dir)
+
+    def held_up(repo_dir, seen):
+        for dependent in dependents[repo_dir]:
+            if dependent not in seen:
+                seen.add(dependent)
+                held_up(dependent, seen)
+        return seen
+
+    weight = {repo_dir: len(held_up(repo_dir, set())) for repo_dir in repo_dirs}
+    order = []
+    remaining = list(repo_dirs)
+    while remaining:
+        ready = [repo_dir for repo_dir in remaining
+            if all(dep in order for dep in dependencies[repo_dir])]
+        if not ready:
+            raise ValueError(f"Dependency cycle between: {', '.join(remaining)}")
+        repo_dir = min(ready, key=lambda repo_dir: (-weight[repo_dir], repo_dirs.index(repo_dir)))
+        order.append(repo_dir)
+        remaining.remove(repo_dir)
+    return order
+
+
+def git_output(repo_dir, *args):
+    """Output of a git command run in repo_dir"""
+    return subprocess.run(["git", *args], cwd=os.path.join(os.getcwd(), repo_dir),
+        check=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout
+
+
+def tree_fingerprint(repo_dir):
+    """
+    Hash of the committed and uncommitted content of repo_dir, or None when
+    it isn't in a git repo
+
+    The committed part is the tree of repo_dir at HEAD rather than the commit
+    itself, so a commit elsewhere in the same repo, like another recipe in
+    conan-recipes, doesn't change it.
+    """
+    try:
+        digest = hashlib.sha256(git_output(repo_dir, "rev-parse", "HEAD:./"))
+        digest.update(git_output(repo_dir, "diff", "HEAD", "--binary", "--", "."))
+        untracked = git_output(repo_dir, "ls-files", "--others", "--exclude-standard", "-z")
+        for name in sorted(filter(None, untracked.split(b"\0"))):
+            digest.update(name + b"\0")
+            path = os.path.join(os.getcwd(), repo_dir, os.fsdecode(name))
+            with open(path, "rb") as untracked_file:
+                digest.update(hashlib.sha256(untracked_file.read()).digest())
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return digest.hexdigest()
+
+
+def fingerprints(order, dependencies):
+    """
+    Fingerprint each dir of order, which lists dependencies first, folding in
+    the fingerprints of the dirs it requires so it reruns when they change
+    """
+    with ThreadPoolExecutor() as executor:
+        own = dict(zip(order, executor.map(tree_fingerprint, order)))
+    combined = {}
+    for repo_dir in order:
+        parts = [own[repo_dir]] + [combined[dep] for dep in dependencies[repo_dir]]
+        combined[repo_dir] = (None if None in parts
+            else hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest())
+    return combined
+
+
+def load_state(state_file):
+    """Fingerprints of the last successful run of each command in each dir"""
+    try:
+        with open(state_file, "r", encoding="utf-8") as state:
+            return json.load(state)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(state_file, state):
+    """
+    Replace the state file with state, so a run that's interrupted or fails
+    halfway through the write leaves the last good state for --incremental
+    """
+    state_dir = os.path.dirname(os.path.abspath(state_file))
+    os.makedirs(state_dir, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=state_dir, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as state_output:
+            json.dump(state, state_output, indent=2, sort_keys=True)
+        os.replace(temp_path, state_file)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def run_in_dir(cmd, repo_dir, capture, log_dir=None):
+    """
+    Run cmd in repo_dir and return its exit code, duration and, when
+    capture is set, its combined stdout and stderr
+    """
+    start_time = time.perf_counter()
+    process = subprocess.run(cmd, cwd=os.path.join(os.getcwd(), repo_dir), shell=True, check=False,
+        stdout=subprocess.PIPE if capture else None,
+        stderr=subprocess.STDOUT if capture else None)
+    output = process.stdout.decode("utf-8", errors="replace") if capture else ""
+    if log_dir:
+        log_path = os.path.join(log_dir, repo_dir.replace("/", "_") + ".log")
+        with open(log_path, "w", encoding="utf-8") as log_file:
+            log_file.write(output)
+    return {
+        "returncode": process.returncode,
+        "duration": time.perf_counter() - start_time,
+        "output": output,
+    }
+
+
+def print_output(repo_dir, output):
+    """Print a dir's captured output in one write, each line prefixed with the dir"""
+    lines = [f"[{repo_dir}] {line}" for line in output.splitlines()]
+    sys.stdout.write("".join(f"{line}\n" for line in lines))
+    sys.stdout.flush()
+
+
+def block_dependents(queue, dependencies, results):
+    """Take the dirs that need a dir that failed or was blocked off the queue"""
+    for repo_dir in list(queue):
+        failed = [dep for dep in dependencies[repo_dir]
+            if dep in results and results[dep]["returncode"] != 0]
+        if failed:
+            queue.remove(repo_dir)
+            results[repo_dir] = {"returncode": None, "duration": 0.0, "output": "",
+                "blocked_by": failed[0]}
+
+
+def run_all(command_args, queue, dependencies, up_to_date=()):
+    """
+    Run the command in each dir of queue, up to --jobs at a time, starting each dir as
+    soon as the dirs it depends on have succeeded, and return the result of
+    each dir that ran, was blocked by a failure or was skipped for being in
+    up_to_date
+
+    Unless --keep-going is set, no new dirs are started after one fails; the
+    ones already running are left to finish, like make does.
+    """
+    # Let the output go straight to the terminal when only one dir runs at a
+    # time, otherwise capture it so dirs don't interleave
+    capture = command_args.jobs > 1 or bool(command_args.log_dir)
+    results = {}
+    queue = list(queue)
+    running = {}
+    failed = False
+    with ThreadPoolExecutor(max_workers=command_args.jobs) as executor:
+        while queue or running:
+            ready = [repo_dir for repo_dir in queue if all(
+                results.get(dep, {}).get("returncode") == 0 for dep in dependencies[repo_dir])]
+            if failed and not command_args.keep_going:
+                ready = []
+            skipped = False
+            for repo_dir in ready:
+                if repo_dir in up_to_date:
+                    queue.remove(repo_dir)
+                    results[repo_dir] = {"returncode": 0, "duration": 0.0, "output": "",
+                        "up_to_date": True}
+                    skipped = True
+                    continue
+                if len(running) >= command_args.jobs:
+                    continue
+                queue.remove(repo_dir)
+                if not capture:
+                    print(f"######## Running '{command_args.cmd}' in {repo_dir}", flush=True)
+                running[executor.submit(run_in_dir, command_args.cmd, repo_dir, capture,
+                    command_args.log_dir)] = repo_dir
+            if not running:
+                if skipped:
+                    continue
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                repo_dir = running.pop(future)
+                result = future.result()
+                results[repo_dir] = result
+                if capture:
+                    print_output(repo_dir, result["output"])
+                else:
+                    print("###################################")
+                    print()
+                if result["returncode"] != 0:
+                    failed = True
+                    block_dependents(queue, dependencies, results)
+    return results
+
+
+def run_incremental(command_args, order, dependencies):
+    """
+    run_all, skipping dirs whose fingerprint matches the last time the
+    command succeeded in them, and recording the dirs it succeeds in now
+    """
+    state = load_state(command_args.state_file)
+    last_success = state.setdefault(command_args.cmd, {})
+    current = fingerprints(order, dependencies)
+    up_to_date = set()
+    if not command_args.force:
+        up_to_date = {repo_dir for repo_dir in order if current[repo_dir] is not None
+            and last_success.get(os.path.abspath(repo_dir)) == current[repo_dir]}
+
+    results = run_all(command_args, order, dependencies, up_to_date)
+    for repo_dir, result in results.items():
+        if result["returncode"] == 0 and current[repo_dir] is not None:
+            last_success[os.path.abspath(repo_dir)] = current[repo_dir]
+    save_state(command_args.state_file, state)
+    return results
+
+
+def print_summary(repo_dirs, results):
+    """Print each dir's status and duration, and the dirs that didn't run"""
+    width = max(len(repo_dir) for repo_dir in repo_dirs)
+    print("######## Summary")
+    for repo_dir in repo_dirs:
+        result = results.get(repo_dir)
+        if result is None:
+            status, duration = "not run", ""
+        elif "blocked_by" in result:
+            status, duration = f"blocked by {result['blocked_by']}", ""
+        elif "up_to_date" in result:
+            status, duration = "up to date", ""
+        else:
+            status = "ok" if result["returncode"] == 0 else f"failed ({result['returncode']})"
+            duration = f"{result['duration']:.1f}s"
+        print(f"{repo_dir:<{width}}  {status:<14}  {duration}".rstrip())
+
 
 def main():
     """
@@ -58,18 +394,41 @@ def main():
     parser.add_argument("--scope",
         choices=list(scope.keys()),
         help="Define the group of dirs where the command should run", required=True)
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+        help="Number of dirs to run the command in at once; "
+            "with more than one, each dir's output is printed when it finishes")
+    parser.add_argument("--keep-going", action="store_true",
+        help="Keep starting dirs after the command fails in one, instead of stopping")
+    parser.add_argument("--log-dir",
+        help="Also write each dir's output to <dir>.log in this directory")
+    parser.add_argument("--incremental", action="store_true",
+        help="Skip dirs where the command succeeded before and nothing, including "
+            "the dirs they require, has changed in git since")
+    parser.add_argument("--force", action="store_true",
+        help="With --incremental, run in every dir anyway and record the new state")
+    parser.add_argument("--state-file", default=DEFAULT_STATE_FILE,
+        help="Where --incremental keeps its state (default: %(default)s)")
     command_args = parser.parse_args()
+    if command_args.jobs < 1:
+        parser.error("--jobs must be at least 1")
 
     repo_dirs = scope[command_args.scope]
+    # Recipes that require each other only run once their requirements succeed
+    dependencies = read_dependencies(repo_dirs)
+    try:
+        order = schedule_order(repo_dirs, dependencies)
+    except ValueError as error:
+        parser.error(str(error))
+    if command_args.log_dir:
+        os.makedirs(command_args.log_dir, exist_ok=True)
 
-    rootdir = os.getcwd()
-    cmd = command_args.cmd
-    for repo_dir in repo_dirs:
-        fullpath = os.path.join(rootdir, repo_dir)
-        print(f"######## Running '{cmd}' in {dir}", flush=True)
-        subprocess.run(cmd, cwd=fullpath, shell=True, check=True)
-        print("###################################")
-        print()
+    if not command_args.incremental:
+        results = run_all(command_args, order, dependencies)
+    else:
+        results = run_incremental(command_args, order, dependencies)
+    print_summary(repo_dirs, results)
+    if any(result["returncode"] != 0 for result in results.values()):
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -4,26 +4,587 @@
 
 import argparse
 import datetime
+import json
+import math
+import os
+import random
+import socket
+import sqlite3
+import statistics
 import subprocess
+import sys
+import threading
 import time
+from collections import Counter
+from contextlib import closing
 
-def main():
+
+# Measurements compared between result files, with how they're shown
+METRICS = {
+    "wall": "wall time (s)",
+    "user": "user CPU (s)",
+    "sys": "system CPU (s)",
+    "max_rss_kib": "max RSS (KiB)",
+    "voluntary_switches": "voluntary context switches",
+    "involuntary_switches": "involuntary context switches",
+}
+PERMUTATIONS = 10000
+# Number of commands named per timeline sample and in the summary
+TOP_COMMANDS = 5
+
+DEFAULT_HISTORY = os.path.join(
+    os.environ.get("XDG_DATA_HOME") or os.path.join(os.path.expanduser("~"), ".local", "share"),
+    "ssrobins-tools", "time-cmd-history.sqlite3")
+# Earlier invocations of the same command, dir and host a new one is compared to
+BASELINE_SIZE = 10
+# Fewer earlier invocations than this are too few to call anything a regression
+MIN_BASELINE = 5
+
+
+def read_process_table():
     """
-    Time running the specified command in the specified directory
+    Map the pid of every process to its parent pid, command name, CPU time in
+    clock ticks, CPU time of the children it has waited for and resident
+    pages, read from /proc
+    """
+    processes = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r", encoding="utf-8", errors="replace") as stat:
+                data = stat.read()
+        except OSError:
+            # The process ended after listing /proc
+            continue
+        # The command name is in parentheses and may itself contain spaces
+        name = data[data.index("(") + 1:data.rindex(")")]
+        fields = data[data.rindex(")") + 2:].split()
+        processes[int(entry)] = {
+            "ppid": int(fields[1]),
+            "name": name,
+            "ticks": int(fields[11]) + int(fields[12]),
+            "waited_ticks": int(fields[13]) + int(fields[14]),
+            "rss_pages": int(fields[21]),
+        }
+    return processes
+
+
+class TreeSampler:
+    """
+    Sample the CPU, memory and processes of a process and all its
+    descendants every interval seconds from a background thread
+    """
+
+    def __init__(self, pid, interval):
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._sample_until_stopped, daemon=True)
+
+    def start(self):
+        """Start sampling"""
+        self._thread.start()
+
+    def stop(self):
+        """Stop sampling and wait for the sampling thread to finish"""
+        self._stopped.set()
+        self._thread.join()
+
+    def tree(self, processes):
+        """The pids of the sampled process and its descendants"""
+        children = {}
+        for pid, process in processes.items():
+            children.setdefault(process["ppid"], []).append(pid)
+        pids = []
+        pending = [self.pid] if self.pid in processes else []
+        while pending:
+            pid = pending.pop()
+            pids.append(pid)
+            pending.extend(children.get(pid, []))
+        return pids
+
+    @staticmethod
+    def tick_deltas(processes, pids, last_seen):
+        """
+        Clock ticks each of pids used since last_seen, which maps pids to their
+        process entries at the last sample
+
+        Children that finished between samples count through the waited-for
+        time of their parent, less what was already counted while they ran.
+        """
+        counted = Counter()
+        for pid, seen in last_seen.items():
+            if pid not in pids:
+                counted[seen["ppid"]] += seen["ticks"] + seen["waited_ticks"]
+        deltas = {}
+        for pid in pids:
+            seen = last_seen.get(pid, {"ticks": 0, "waited_ticks": 0})
+            waited = processes[pid]["waited_ticks"] - seen["waited_ticks"] - counted[pid]
+            deltas[pid] = processes[pid]["ticks"] - seen["ticks"] + max(waited, 0)
+        return deltas
+
+    def _sample_until_stopped(self):
+        ticks_per_second = os.sysconf("SC_CLK_TCK")
+        page_kib = os.sysconf("SC_PAGE_SIZE") // 1024
+        start_time = time.perf_counter()
+        last_time = start_time
+        last_seen = {}
+        while not self._stopped.wait(self.interval):
+            processes = read_process_table()
+            now = time.perf_counter()
+            pids = self.tree(processes)
+            if not pids:
+                break
+            cpu = Counter()
+            for pid, ticks in self.tick_deltas(processes, pids, last_seen).items():
+                cpu[processes[pid]["name"]] += ticks / ticks_per_second / (now - last_time)
+            last_seen = {pid: processes[pid] for pid in pids}
+            cores = sum(cpu.values())
+            self.samples.append({
+                "time": now - start_time,
+                "interval": now - last_time,
+                "cpu_cores": cores,
+                "utilization": cores / (os.cpu_count() or 1),
+                "rss_kib": sum(processes[pid]["rss_pages"] for pid in pids) * page_kib,
+                "processes": len(pids),
+                "top": [[name, round(cores, 3)]
+                    for name, cores in cpu.most_common(TOP_COMMANDS) if cores > 0],
+            })
+            last_time = now
+
+
+def longest_serial_stretch(samples):
+    """
+    Length of the longest stretch of samples with at most one core busy,
+    like a serial link step, and the commands busiest during it
     """
+    longest, current = 0.0, 0.0
+    commands, longest_commands = Counter(), Counter()
+    for sample in samples:
+        if sample["cpu_cores"] <= 1.0:
+            current += sample["interval"]
+            commands.update(dict(sample["top"]))
+            if current > longest:
+                longest, longest_commands = current, Counter(commands)
+        else:
+            current, commands = 0.0, Counter()
+    return longest, [name for name, _ in longest_commands.most_common(3)]
+
+
+def sampling_summary(samples, wall_time):
+    """
+    Lines on how well the sampled runs used the cores: how busy they were on
+    average, how long they ran serially or saturated, and which commands
+    used the CPU
+    """
+    cpu_count = os.cpu_count() or 1
+    cpu_seconds = sum(sample["cpu_cores"] * sample["interval"] for sample in samples)
+    parallelism = cpu_seconds / wall_time if wall_time else 0.0
+    serial = sum(sample["interval"] for sample in samples if sample["cpu_cores"] <= 1.0)
+    saturated = sum(sample["interval"] for sample in samples
+        if sample["utilization"] >= 0.9)
+    commands = Counter()
+    for sample in samples:
+        for name, cores in sample["top"]:
+            commands[name] += cores * sample["interval"]
+
+    lines = [
+        f"average parallelism: {parallelism:.2f} of {cpu_count} cores "
+            f"({parallelism / cpu_count:.0%} efficiency)",
+        f"time at most one core busy: {serial:.1f}s, time 90%+ of cores busy: {saturated:.1f}s",
+        f"peak RSS: {max(sample['rss_kib'] for sample in samples)} KiB, "
+            f"peak processes: {max(sample['processes'] for sample in samples)}",
+    ]
+    longest, busiest = longest_serial_stretch(samples)
+    if longest:
+        lines.append(f"longest serial stretch: {longest:.1f}s ({', '.join(busiest) or 'idle'})")
+    lines.append("CPU time by command:")
+    lines.extend(f"  {name}: {seconds:.1f}s"
+        for name, seconds in commands.most_common(TOP_COMMANDS))
+    return lines
+
+
+def usage_metrics(usage):
+    """The metrics of a resource usage from os.wait4"""
+    return {
+        "user": usage.ru_utime,
+        "sys": usage.ru_stime,
+        # macOS reports bytes, Linux KiB
+        "max_rss_kib": usage.ru_maxrss // 1024 if sys.platform == "darwin" else usage.ru_maxrss,
+        "voluntary_switches": usage.ru_nvcsw,
+        "involuntary_switches": usage.ru_nivcsw,
+    }
+
+
+def run_once(cmd, cwd, sample_interval=None):
+    """
+    Run cmd once and return its wall time and the resource usage of it and
+    everything it started, with samples of its process tree when
+    sample_interval is given
+    """
+    usage = None
+    start_time = time.perf_counter()
+    with subprocess.Popen(cmd, cwd=cwd, shell=True) as process:
+        tree_sampler = TreeSampler(process.pid, sample_interval) if sample_interval else None
+        if tree_sampler:
+            tree_sampler.start()
+        if not hasattr(os, "wait4"):  # Windows
+            returncode = process.wait()
+        else:
+            # wait4 gives the usage of this one run, where RUSAGE_CHILDREN would
+            # keep the peak RSS of every earlier run too
+            _, status, usage = os.wait4(process.pid, 0)
+            returncode = process.returncode = os.waitstatus_to_exitcode(status)
+        if tree_sampler:
+            tree_sampler.stop()
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, cmd)
+    run = {"wall": time.perf_counter() - start_time}
+    if tree_sampler:
+        run["samples"] = tree_sampler.samples
+    if usage is not None:
+        run.update(usage_metrics(usage))
+    return run
+
+
+def summarize(runs):
+    """Min, median, mean and standard deviation of each metric over runs"""
+    summary = {}
+    for metric in METRICS:
+        values = [run[metric] for run in runs if metric in run]
+        if values:
+            summary[metric] = {
+                "min": min(values),
+                "median": statistics.median(values),
+                "mean": statistics.mean(values),
+                "stddev": statistics.stdev(values) if len(values) > 1 else 0.0,
+            }
+    return summary
+
+
+def smallest_p_value(baseline, candidate):
+    """
+    Smallest p-value permutation_test can give for samples of these sizes,
+    when the observed split is the most extreme of all possible ones
+    """
+    mirrored = 2 if len(baseline) == len(candidate) else 1
+    return min(mirrored / math.comb(len(baseline) + len(candidate), len(baseline)), 1.0)
+
+
+def runs_needed(alpha):
+    """Fewest runs in each of two equal samples for permutation_test to reach alpha"""
+    runs = 2
+    while smallest_p_value([0] * runs, [0] * runs) >= alpha:
+        runs += 1
+    return runs
+
+
+def permutation_test(baseline, candidate, seed=0):
+    """
+    Two-sided p-value for the difference in means between baseline and
+    candidate, from random relabellings of the pooled samples
+    """
+    observed = abs(statistics.mean(candidate) - statistics.mean(baseline))
+    pooled = list(baseline) + list(candidate)
+    generator = random.Random(seed)
+    extreme = 0
+    for _ in range(PERMUTATIONS):
+        generator.shuffle(pooled)
+        difference = (statistics.mean(pooled[len(baseline):])
+            - statistics.mean(pooled[:len(baseline)]))
+        if abs(difference) >= observed:
+            extreme += 1
+    return (extreme + 1) / (PERMUTATIONS + 1)
+
+
+def compare_metric(label, before, after, alpha):
+    """
+    Print how one metric changed, and return whether the change is
+    significant and an increase, or None when there are too few runs for
+    any change to be significant at alpha
+    """
+    before_mean = statistics.mean(before)
+    after_mean = statistics.mean(after)
+    change = (after_mean - before_mean) / before_mean * 100 if before_mean else 0.0
+    floor = smallest_p_value(before, after)
+    if floor >= alpha:
+        print(f"{label}: {before_mean:.3f} -> {after_mean:.3f} ({change:+.1f}%, "
+            f"too few runs to test: p can't go below {floor:.3f})")
+        return None
+    p_value = permutation_test(before, after)
+    significant = p_value < alpha
+    verdict = f"p={p_value:.3f}, {'significant' if significant else 'not significant'}"
+    print(f"{label}: {before_mean:.3f} -> {after_mean:.3f} ({change:+.1f}%, {verdict})")
+    return significant and after_mean > before_mean
+
+
+def compare(baseline_path, candidate_path, alpha):
+    """
+    Print how each metric changed between two result files, and return
+    whether the wall time got significantly slower or the files have too
+    few runs to tell
+    """
+    with open(baseline_path, "r", encoding="utf-8") as baseline_file:
+        baseline = json.load(baseline_file)
+    with open(candidate_path, "r", encoding="utf-8") as candidate_file:
+        candidate = json.load(candidate_file)
+
+    slower = False
+    for metric, label in METRICS.items():
+        before = [run[metric] for run in baseline["runs"] if metric in run]
+        after = [run[metric] for run in candidate["runs"] if metric in run]
+        if before and after:
+            increased = compare_metric(label, before, after, alpha)
+            if metric == "wall" and increased is None:
+                print(f"Time at least {runs_needed(alpha)} runs in each file to compare "
+                    f"them at --alpha {alpha}", file=sys.stderr)
+            slower = slower or (metric == "wall" and increased is not False)
+    return slower
+
+
+def open_history(path):
+    """Open the history database at path, creating it if needed"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    connection = sqlite3.connect(path)
+    connection.executescript("""
+        CREATE TABLE IF NOT EXISTS invocations (
+            id INTEGER PRIMARY KEY,
+            recorded_at TEXT NOT NULL,
+            command TEXT NOT NULL,
+            directory TEXT NOT NULL,
+            git_commit TEXT,
+            host TEXT NOT NULL,
+            warmup INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS invocations_key
+            ON invocations (command, directory, host, id);
+        CREATE TABLE IF NOT EXISTS runs (
+            invocation_id INTEGER NOT NULL REFERENCES invocations (id),
+            wall REAL NOT NULL,
+            user REAL,
+            sys REAL,
+            max_rss_kib INTEGER,
+            voluntary_switches INTEGER,
+            involuntary_switches INTEGER
+        );
+        CREATE INDEX IF NOT EXISTS runs_invocation ON runs (invocation_id);
+    """)
+    return connection
+
+
+def git_commit(directory):
+    """The commit checked out in directory, or None when it isn't in a git repo"""
+    try:
+        output = subprocess.run(["git", "rev-parse", "HEAD"], cwd=directory, check=False,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except OSError:
+        return None
+    return output.stdout.decode("utf-8").strip() if output.returncode == 0 else None
+
+
+def record_history(path, cmd, directory, warmup, runs):
+    """Append an invocation and its runs to the history at path"""
+    directory = os.path.abspath(directory)
+    with closing(open_history(path)) as connection:
+        # One transaction, so an invocation is never stored without its runs
+        with connection:
+            cursor = connection.execute(
+                "INSERT INTO invocations (recorded_at, command, directory, git_commit, host, "
+                "warmup) VALUES (?, ?, ?, ?, ?, ?)",
+                (datetime.datetime.now().isoformat(timespec="seconds"), cmd, directory,
+                    git_commit(directory), socket.gethostname(), warmup))
+            connection.executemany("INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(cursor.lastrowid, run["wall"], run.get("user"), run.get("sys"),
+                    run.get("max_rss_kib"), run.get("voluntary_switches"),
+                    run.get("involuntary_switches")) for run in runs])
+
+
+def load_history(path, cmd=None, directory=None):
+    """Recorded invocations, oldest first, with the wall times of their runs"""
+    conditions, params = [], []
+    if cmd:
+        conditions.append("command = ?")
+        params.append(cmd)
+    if directory:
+        conditions.append("directory = ?")
+        params.append(os.path.abspath(directory))
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    with closing(open_history(path)) as connection:
+        invocations = {row[0]: {
+            "recorded_at": row[1],
+            "command": row[2],
+            "directory": row[3],
+            "git_commit": row[4],
+            "host": row[5],
+            "walls": [],
+        } for row in connection.execute("SELECT id, recorded_at, command, directory, "
+            f"git_commit, host FROM invocations{where} ORDER BY id", params)}
+        # Only the runs of the invocations asked for, not the whole history
+        for invocation_id, wall in connection.execute("SELECT runs.invocation_id, runs.wall "
+            f"FROM runs JOIN invocations ON invocations.id = runs.invocation_id{where}",
+            params):
+            invocations[invocation_id]["walls"].append(wall)
+    return [invocation for invocation in invocations.values() if invocation["walls"]]
+
+
+def flag_regressions(invocations, threshold):
+    """
+    Compare each invocation's median wall time to the invocations before it
+    with the same command, dir and host, and flag it as a regression when
+    it's more than threshold robust standard deviations slower
+
+    The baseline's spread is its median absolute deviation, so one earlier
+    outlier doesn't hide a regression.
+    """
+    earlier = {}
+    for invocation in invocations:
+        medians = earlier.setdefault(
+            (invocation["command"], invocation["directory"], invocation["host"]), [])
+        invocation["median"] = statistics.median(invocation["walls"])
+        invocation["baseline"] = None
+        invocation["regression"] = False
+        baseline = medians[-BASELINE_SIZE:]
+        if len(baseline) >= MIN_BASELINE:
+            center = statistics.median(baseline)
+            spread = 1.4826 * statistics.median(abs(value - center) for value in baseline)
+            # Identical baseline times would make any change infinitely significant
+            spread = max(spread, 0.01 * center)
+            invocation["baseline"] = center
+            invocation["regression"] = (invocation["median"] - center) / spread > threshold
+        medians.append(invocation["median"])
+    return invocations
+
+
+def describe_invocation(invocation):
+    """One line on an invocation and how it compares to its baseline"""
+    commit = (invocation["git_commit"] or "no commit")[:10]
+    line = (f"  {invocation['recorded_at']}  {commit:<10}  {len(invocation['walls'])} runs  "
+        f"median {invocation['median']:.3f}s")
+    if invocation["baseline"]:
+        change = (invocation["median"] - invocation["baseline"]) / invocation["baseline"]
+        line += f"  {change:+.1%} vs baseline"
+    if invocation["regression"]:
+        line += "  REGRESSION"
+    return line
+
+
+def query_history(path, cmd, directory, limit, threshold):
+    """
+    Print the latest invocations of each command, dir and host, and return
+    whether the latest of any of them is a regression
+    """
+    keys = {}
+    for invocation in flag_regressions(load_history(path, cmd, directory), threshold):
+        keys.setdefault((invocation["command"], invocation["directory"], invocation["host"]),
+            []).append(invocation)
+    for (key_cmd, key_dir, host), invocations in keys.items():
+        print(f"'{key_cmd}' in {key_dir} on {host}")
+        for invocation in invocations[-limit:]:
+            print(describe_invocation(invocation))
+    return any(invocations[-1]["regression"] for invocations in keys.values())
+
+
+def parse_args():
+    """Command line options, checked for combinations that don't work"""
     parser = argparse.ArgumentParser()
     parser.add_argument("--cmd",
-        help="Command you want to time", required=True)
+        help="Command you want to time")
     parser.add_argument("--dir",
-        help="Current working directory for command", required=True)
+        help="Current working directory for command")
+    parser.add_argument("--repeat", type=int, default=1,
+        help="Number of timed runs")
+    parser.add_argument("--warmup", type=int, default=0,
+        help="Number of untimed runs before the timed ones, to warm caches")
+    parser.add_argument("--json",
+        help="Write every run and the summary to this file")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CANDIDATE"),
+        help="Compare two --json files instead of timing, exiting with 1 when the "
+            "candidate's wall time is significantly slower, or there are too few runs "
+            "to tell at --alpha")
+    parser.add_argument("--alpha", type=float, default=0.05,
+        help="Significance level for --compare (default: %(default)s)")
+    parser.add_argument("--sample", type=float, metavar="SECONDS",
+        help="Sample the CPU, memory and processes of the command's process tree "
+            "from /proc this often, and summarize how well it used the cores")
+    parser.add_argument("--timeline",
+        help="With --sample, write every sample to this file as JSON lines")
+    parser.add_argument("--history", default=DEFAULT_HISTORY,
+        help="SQLite database every timing is added to (default: %(default)s)")
+    parser.add_argument("--no-history", action="store_true",
+        help="Don't add this timing to the history")
+    parser.add_argument("--query", action="store_true",
+        help="Show the history instead of timing, for --cmd and --dir if given, "
+            "exiting with 1 when the latest timing of any command is a regression")
+    parser.add_argument("--limit", type=int, default=10,
+        help="Number of timings per command --query shows (default: %(default)s)")
+    parser.add_argument("--regression-threshold", type=float, default=3.0,
+        help="Robust standard deviations above the recent baseline that count as a "
+            "regression (default: %(default)s)")
     command_args = parser.parse_args()
 
-    start_time = time.time()
-    subprocess.run(command_args.cmd, cwd=command_args.dir, shell=True, check=True)
-    end_time = time.time()
+    if command_args.compare or command_args.query:
+        return command_args
+    if not command_args.cmd or not command_args.dir:
+        parser.error("--cmd and --dir are required unless --compare or --query is used")
+    if command_args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+    if command_args.sample and not os.path.exists("/proc/self/stat"):
+        parser.error("--sample needs /proc, which this system doesn't have")
+    return command_args
+
+
+def main():
+    """
+    Time running the specified command in the specified directory
+    """
+    command_args = parse_args()
+    if command_args.compare:
+        sys.exit(1 if compare(*command_args.compare, command_args.alpha) else 0)
+    if command_args.query:
+        sys.exit(1 if query_history(command_args.history, command_args.cmd, command_args.dir,
+            command_args.limit, command_args.regression_threshold) else 0)
+
+    for _ in range(command_args.warmup):
+        subprocess.run(command_args.cmd, cwd=command_args.dir, shell=True, check=True)
+    runs = [run_once(command_args.cmd, command_args.dir, command_args.sample)
+        for _ in range(command_args.repeat)]
+    samples = [dict(sample, run=index)
+        for index, run in enumerate(runs) for sample in run.pop("samples", [])]
+    summary = summarize(runs)
 
     print(f"duration of the command '{command_args.cmd}' in hours:minutes:seconds")
-    print(str(datetime.timedelta(seconds=end_time - start_time)))
+    print(str(datetime.timedelta(seconds=summary["wall"]["median"])))
+    if command_args.repeat > 1:
+        for metric, stats in summary.items():
+            print(f"{METRICS[metric]}: min {stats['min']:.3f}, median {stats['median']:.3f}, "
+                f"mean {stats['mean']:.3f}, stddev {stats['stddev']:.3f}")
+    if samples:
+        wall_time = sum(run["wall"] for run in runs)
+        print("\n".join(sampling_summary(samples, wall_time)))
+    if command_args.timeline:
+        with open(command_args.timeline, "w", encoding="utf-8") as timeline_file:
+            timeline_file.writelines(f"{json.dumps(sample)}\n" for sample in samples)
+
+    if command_args.json:
+        with open(command_args.json, "w", encoding="utf-8") as json_file:
+            json.dump({
+                "cmd": command_args.cmd,
+                "dir": command_args.dir,
+                "warmup": command_args.warmup,
+                "runs": runs,
+                "summary": summary,
+            }, json_file, indent=2)
+
+    if not command_args.no_history:
+        record_history(command_args.history, command_args.cmd, command_args.dir,
+            command_args.warmup, runs)
+        latest = flag_regressions(load_history(command_args.history, command_args.cmd,
+            command_args.dir), command_args.regression_threshold)[-1]
+        if latest["regression"]:
+            print(f"Regression: median {latest['median']:.3f}s against a recent baseline of "
+                f"{latest['baseline']:.3f}s")
 
 
 if __name__ == "__main__":
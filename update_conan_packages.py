@@ -3,58 +3,208 @@
 """Tool to update Conan dependencies to the latest"""
 
 import argparse
+import ast
+import difflib
+import glob
+import hashlib
 import json
 import os
 import re
 import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 
-def main():
+RECIPES_DIR = "conan-recipes/recipes"
+# Versions conan inspect reported for recipes that compute theirs, by conanfile.py hash
+DEFAULT_CACHE_FILE = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "ssrobins-tools", "conan-versions.json")
+
+
+def static_version(conan_file_content):
     """
-    Read Conan dependencies, look for updates, and update the conanfile.py with updates
+    Version a recipe sets as a plain string class attribute, or None when
+    it's computed and only Conan can tell
     """
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--repo", help="Repo name of the package to update", required=True)
-    command_args = parser.parse_args()
+    try:
+        tree = ast.parse(conan_file_content)
+    except SyntaxError:
+        return None
+    if any(isinstance(node, ast.FunctionDef) and node.name == "set_version"
+        for node in ast.walk(tree)):
+        return None
+
+    for class_node in tree.body:
+        if not isinstance(class_node, ast.ClassDef):
+            continue
+        for statement in class_node.body:
+            if isinstance(statement, ast.Assign):
+                targets = statement.targets
+            elif isinstance(statement, ast.AnnAssign):
+                targets = [statement.target]
+            else:
+                continue
+            if any(isinstance(target, ast.Name) and target.id == "version" for target in targets):
+                value = statement.value
+                if isinstance(value, ast.Constant) and isinstance(value.value, str):
+                    return value.value
+                return None
+    return None
+
+
+def inspect_version(recipe_dir):
+    """Version of the recipe in recipe_dir according to conan inspect"""
+    conan_inspect_output = subprocess.run("conan inspect . --format json",
+        cwd=recipe_dir, shell=True, check=True, stdout=subprocess.PIPE)
+    conan_inspect_json = json.loads(conan_inspect_output.stdout.decode("utf-8"))
+    return conan_inspect_json["version"]
+
+
+def load_cache(cache_file):
+    """Versions conan inspect found before, by the hash of the conanfile.py"""
+    try:
+        with open(cache_file, "r", encoding="utf-8") as cache:
+            return json.load(cache)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(cache_file, cache):
+    """
+    Replace the version cache with cache, keeping the old one intact if the
+    write fails, so the next run still skips the conan inspect calls it can
+    """
+    cache_dir = os.path.dirname(os.path.abspath(cache_file))
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=cache_dir, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as cache_output:
+            json.dump(cache, cache_output, indent=2, sort_keys=True)
+        os.replace(temp_path, cache_file)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def resolve_versions(names, cache_file=DEFAULT_CACHE_FILE):
+    """
+    Latest version of each recipe in names, read from its conanfile.py where
+    possible, otherwise from conan inspect, run in parallel and cached
+    """
+    versions = {}
+    dynamic = {}
+    cache = load_cache(cache_file)
+    for name in dict.fromkeys(names):
+        with open(os.path.join(RECIPES_DIR, name, "conanfile.py"), "rb") as conan_file:
+            content = conan_file.read()
+        content_hash = hashlib.sha256(content).hexdigest()
+        version = static_version(content) or cache.get(content_hash)
+        if version is None:
+            dynamic[name] = content_hash
+        else:
+            versions[name] = version
+
+    if dynamic:
+        recipe_dirs = [os.path.join(RECIPES_DIR, name) for name in dynamic]
+        with ThreadPoolExecutor() as executor:
+            for (name, content_hash), version in zip(dynamic.items(),
+                executor.map(inspect_version, recipe_dirs)):
+                versions[name] = version
+                cache[content_hash] = version
+        save_cache(cache_file, cache)
+    return versions
 
-    fullpath = os.path.join(os.getcwd(), command_args.repo)
 
-    with open(os.path.join(fullpath, "conanfile.py"),
-        "r", encoding="utf-8", newline="") as conan_file:
-        conan_file_content = conan_file.read()
+def update_content(path, conan_file_content, latest_versions):
+    """
+    conan_file_content, read from path, with every requirement on a recipe
+    in latest_versions moved to the latest version, printing each replacement
+    """
+    package_strings = re.findall(r'requires\("(.*?)/(.*?)@', conan_file_content)
+    for name, version in package_strings:
+        if name not in latest_versions:
+            continue
+        old_package = f"{name}/{version}"
+        new_package = f"{name}/{latest_versions[name]}"
 
-        packages = []
-        package_strings = re.findall(r'requires\("(.*?)/(.*?)@', conan_file_content)
+        if old_package != new_package and old_package in conan_file_content:
+            conan_file_content = conan_file_content.replace(old_package, new_package)
 
-        for package_string in package_strings:
-            package = {
-                "name": package_string[0],
-                "version": package_string[1],
-            }
-            packages.append(package)
+            print(f"Replace in {path}:")
+            print(f"  {old_package}")
+            print("With:")
+            print(f"  {new_package}")
+            print()
+    return conan_file_content
+
+
+def write_if_changed(path, old_content, new_content, dry_run=False):
+    """
+    Replace the file at path with new_content in one step, or print the diff
+    when dry_run is set; an unchanged file isn't touched, so it keeps its mtime
+    """
+    if new_content == old_content:
+        return False
+    if dry_run:
+        print("".join(difflib.unified_diff(old_content.splitlines(keepends=True),
+            new_content.splitlines(keepends=True), f"a/{path}", f"b/{path}")))
+        return True
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w", encoding="utf-8", newline="") as conan_file:
+        conan_file.write(new_content)
+    os.replace(temp_path, path)
+    return True
 
-        for package in packages:
-            conan_inspect_output = subprocess.run("conan inspect . --format json",
-                cwd=f"conan-recipes/recipes/{package['name']}",
-                shell=True, check=True, stdout=subprocess.PIPE)
-            conan_inspect_json = json.loads(conan_inspect_output.stdout.decode("utf-8"))
-            package["latest_version"] = conan_inspect_json["version"]
 
-            old_package = f"{package['name']}/{package['version']}"
-            new_package = f"{package['name']}/{package['latest_version']}"
+def workspace_conan_files():
+    """The conanfile.py of each repo in the current dir and each recipe in conan-recipes"""
+    return sorted(glob.glob(os.path.join("*", "conanfile.py"))
+        + glob.glob(os.path.join(RECIPES_DIR, "*", "conanfile.py")))
+
+
+def main():
+    """
+    Read Conan dependencies, look for updates, and update the conanfile.py with updates
+    """
+    parser = argparse.ArgumentParser()
+    targets = parser.add_mutually_exclusive_group(required=True)
+    targets.add_argument("--repo", help="Repo name of the package to update")
+    targets.add_argument("--all", action="store_true",
+        help="Update every repo in the current dir and every recipe in " + RECIPES_DIR)
+    parser.add_argument("--dry-run", action="store_true",
+        help="Print the changes as a diff instead of writing them")
+    parser.add_argument("--cache-file", default=DEFAULT_CACHE_FILE,
+        help="Where versions from conan inspect are cached (default: %(default)s)")
+    command_args = parser.parse_args()
 
-            if old_package != new_package and old_package in conan_file_content:
-                conan_file_content = conan_file_content.replace(old_package, new_package)
+    if command_args.all:
+        conan_file_paths = workspace_conan_files()
+        # Resolve every recipe once up front, rather than once per repo using it
+        recipe_names = [os.path.basename(os.path.dirname(path))
+            for path in glob.glob(os.path.join(RECIPES_DIR, "*", "conanfile.py"))]
+    else:
+        conan_file_paths = [os.path.join(command_args.repo, "conanfile.py")]
+        recipe_names = None
 
-                print("Replace:")
-                print(f"  {old_package}")
-                print("With:")
-                print(f"  {new_package}")
-                print()
+    contents = {}
+    for path in conan_file_paths:
+        with open(path, "r", encoding="utf-8", newline="") as conan_file:
+            contents[path] = conan_file.read()
+    if recipe_names is None:
+        recipe_names = [name for content in contents.values()
+            for name, _ in re.findall(r'requires\("(.*?)/(.*?)@', content)]
+    latest_versions = resolve_versions(recipe_names, command_args.cache_file)
 
-    with open(os.path.join(fullpath, "conanfile.py"),
-        "w", encoding="utf-8", newline="") as conan_file:
-        conan_file.write(conan_file_content)
+    changed = []
+    for path, content in contents.items():
+        if write_if_changed(path, content, update_content(path, content, latest_versions),
+            command_args.dry_run):
+            changed.append(path)
+    if command_args.all:
+        print(f"{len(changed)} of {len(contents)} conanfile.py files "
+            f"{'would change' if command_args.dry_run else 'changed'}")
 
 
 if __name__ == "__main__":